@@ -1,8 +1,67 @@
 from array import array
 import math
+import struct
+from typing import Callable, Hashable, NamedTuple, TypeVar
+import weakref
 
 import pytest
 
+T = TypeVar("T")
+
+
+class InternInfo(NamedTuple):
+    hits: int
+    misses: int
+    evictions: int  # dropped because the cache was full
+    collected: int  # dropped because the object was garbage collected
+    currsize: int
+    maxsize: int
+
+
+class InternCache:
+    # bounded cache of weak references to immutable objects, keyed by their value
+    # it doesn't keep objects alive - an entry goes away when its object is garbage collected,
+    # and when the cache is full the least recently used entry is evicted
+
+    def __init__(self, maxsize: int = 65536):
+        self.maxsize = maxsize
+        self._refs: dict[Hashable, weakref.ref] = {}
+        self._hits = self._misses = self._evictions = self._collected = 0
+
+    def get(self, key: Hashable, factory: Callable[[], T]) -> T:
+        ref = self._refs.pop(key, None)
+        obj = None if ref is None else ref()
+        if obj is not None:
+            self._hits += 1
+            self._refs[key] = ref  # reinserted as the most recently used
+            return obj
+        self._misses += 1
+        obj = factory()
+        if len(self._refs) >= self.maxsize:
+            del self._refs[next(iter(self._refs))]
+            self._evictions += 1
+        self._refs[key] = weakref.ref(obj, lambda ref: self._discard(key, ref))
+        return obj
+
+    def _discard(self, key: Hashable, ref: weakref.ref) -> None:
+        if self._refs.get(key) is ref:
+            del self._refs[key]
+            self._collected += 1
+
+    def cache_info(self) -> InternInfo:
+        return InternInfo(
+            self._hits,
+            self._misses,
+            self._evictions,
+            self._collected,
+            len(self._refs),
+            self.maxsize,
+        )
+
+    def cache_clear(self) -> None:
+        self._refs.clear()
+        self._hits = self._misses = self._evictions = self._collected = 0
+
 
 class Vector2d:
     typecode = "d"  # used for converting to and from bytes
@@ -10,9 +69,21 @@ class Vector2d:
     __slots__ = (
         "__x",
         "__y",
+        "__weakref__",
     )  # slots change the way instance attributes are stored - from dict to, in this case, a tuple
     # if __slots__ are present without explicit __dict__ in __slots__, __dict__ is not created and is not available
     # because of that you can't use 'cached_property' decorator, if you want to use it, you need to add __dict__ to __slots__
+    # the same goes for weak references - '__weakref__' has to be in __slots__, it is needed by the intern cache
+
+    intern_cache = InternCache()
+    _pack = struct.Struct("dd").pack  # bit exact keys: -0.0 and 0.0 are interned separately
+
+    @classmethod
+    def interned(cls, x: float | str, y: float | str) -> "Vector2d":
+        # opt-in sharing of instances with the same coordinates, e.g. grid points or zero vectors
+        # safe because Vector2d is immutable; the cache only holds weak references
+        x, y = float(x), float(y)
+        return cls.intern_cache.get((cls, cls._pack(x, y)), lambda: cls(x, y))
 
     @classmethod
     def frombytes(cls, octets: bytes) -> "Vector2d":
@@ -32,9 +103,11 @@ class Vector2d:
     def y(self):
         return self.__y
 
+    # __iter__, __eq__ and __hash__ read the slots directly - no property calls and no generator,
+    # because they run on every unpacking, dict lookup and set membership test
     def __iter__(self):
-        return (
-            i for i in (self.x, self.y)
+        return iter(
+            (self.__x, self.__y)
         )  # it makes Vector2d iterable, which allows for unpacking
 
     def __repr__(self):
@@ -42,22 +115,28 @@ class Vector2d:
         return f"{class_name}({self.x!r}, {self.y!r})"
 
     def __str__(self):
-        return str(tuple(self))
+        return str((self.__x, self.__y))
 
     def __bytes__(self):
-        return bytes([ord(self.typecode)]) + bytes(array(self.typecode, self))
+        return bytes([ord(self.typecode)]) + bytes(
+            array(self.typecode, (self.__x, self.__y))
+        )
 
     def __eq__(self, other: "Vector2d"):
+        if self is other:  # common with interned vectors
+            return True
+        if isinstance(other, Vector2d):  # subclasses share the slots, so ShortVector2d works too
+            return self.__x == other.__x and self.__y == other.__y
         return tuple(self) == tuple(other)
 
     def __abs__(self):
-        return math.hypot(self.x, self.y)
+        return math.hypot(self.__x, self.__y)
 
     def __bool__(self):
         return bool(abs(self))
 
     def angle(self):
-        return math.atan2(self.y, self.x)
+        return math.atan2(self.__y, self.__x)
 
     def __format__(self, format_spec: str = ""):
         if format_spec.endswith("p"):
@@ -71,7 +150,7 @@ class Vector2d:
         return outer_fmt.format(*components)
 
     def __hash__(self):
-        return hash((self.x, self.y))
+        return hash((self.__x, self.__y))
 
 
 def test_vector2d_format():
@@ -91,6 +170,41 @@ def test_vector2d_hash():
     assert hash(v1) != hash(v2)
 
 
+def test_vector2d_eq_and_unpacking():
+    v1 = Vector2d(3, 4)
+    x, y = v1
+    assert (x, y) == (3.0, 4.0)
+    assert v1 == Vector2d(3.0, 4.0)
+    assert v1 != Vector2d(3, 5)
+    assert v1 == (3, 4)  # like before, any iterable with equal items compares equal
+    assert v1 == ShortVector2d(3, 4)
+    assert len({v1, Vector2d(3, 4), ShortVector2d(3, 4)}) == 1
+
+
+def test_vector2d_interned():
+    Vector2d.intern_cache.cache_clear()
+    v1 = Vector2d.interned(3, 4)
+    v2 = Vector2d.interned(3.0, "4")
+    assert v1 is v2
+    assert v1 is not Vector2d(3, 4) and v1 == Vector2d(3, 4)
+    zeros = [Vector2d.interned(-0.0, 0), Vector2d.interned(0, 0)]
+    assert zeros[0] is not zeros[1]
+    short = ShortVector2d.interned(3, 4)
+    assert type(short) is ShortVector2d
+    info = Vector2d.intern_cache.cache_info()
+    assert (info.hits, info.misses, info.currsize) == (1, 4, 4)
+
+
+def test_intern_cache_eviction_and_collection():
+    cache = InternCache(maxsize=2)
+    keep = [cache.get(i, lambda: Vector2d(i, i)) for i in range(3)]
+    assert cache.cache_info().evictions == 1
+    assert cache.get(0, lambda: Vector2d(0, 0)) is not keep[0]  # evicted, so created again
+    del keep
+    info = cache.cache_info()
+    assert info.collected == 2 and info.currsize == 0
+
+
 def test_vector2d_pattern_match():
     vectors = [Vector2d(0, 0), Vector2d(1, 1), Vector2d(2, 3)]
     for v in vectors:
@@ -0,0 +1,315 @@
+from array import array
+from collections.abc import Iterable, Iterator
+import heapq
+import itertools
+import math
+import random
+import time
+from typing import Any, List, Optional, Tuple, Union
+
+import pytest
+
+from .a_pythonic_object import Vector2d
+from .vector2d_array import Vector2dArray
+
+
+# a linear scan calling abs() on differences is O(n) for every nearest point or radius query
+# KDTree is a 2-d tree - every level splits the plane on x or y, alternately,
+# so queries only visit the branches that can contain an answer: O(log n) on average
+# points can be anything with x and y attributes (Vector2d, the chapter 1 Vector, ...),
+# or raw coordinates x0, y0, x1, y1, ... in an array('d') or memoryview, which are indexed as Vector2d
+# inserts keep the tree as it is until a path gets too deep, then only the subtree that is
+# out of balance is rebuilt (as in a scapegoat tree): O(log n) amortized per insert, even for
+# sorted points; deletes only mark nodes, the tree is rebuilt once half of them are deleted
+
+Coords = Union[array, memoryview]
+
+# a subtree is out of balance when one of its children holds more than ALPHA of its nodes,
+# a path longer than log(size, 1 / ALPHA) always goes through such a subtree
+ALPHA = 0.7
+
+
+class _Node:
+    __slots__ = ("point", "x", "y", "left", "right", "deleted", "size")
+
+    def __init__(self, point: Any, x: float, y: float):
+        self.point = point
+        self.x = x
+        self.y = y
+        self.left: Optional[_Node] = None
+        self.right: Optional[_Node] = None
+        self.deleted = False
+        self.size = 1  # nodes in the subtree, deleted ones included
+
+
+class KDTree:
+    def __init__(self, points: Union[Iterable[Any], Coords] = ()):
+        self._root: Optional[_Node] = None
+        self._size = 0
+        self._deleted = 0
+        self._rebuild([_Node(p, p.x, p.y) for p in self._points(points)])
+
+    @staticmethod
+    def _points(points: Union[Iterable[Any], Coords]) -> Iterable[Any]:
+        if isinstance(points, Vector2dArray):
+            return iter(points)
+        if isinstance(points, (array, memoryview)):
+            return map(Vector2d, points[0::2], points[1::2])
+        return points
+
+    def _rebuild(self, nodes: List[_Node]) -> None:
+        self._size = len(nodes)
+        self._deleted = 0
+        self._root = self._build(nodes, 0)
+
+    def _build(self, nodes: List[_Node], axis: int) -> Optional[_Node]:
+        if not nodes:
+            return None
+        nodes.sort(key=(lambda n: n.y) if axis else (lambda n: n.x))
+        middle = len(nodes) // 2
+        node = nodes[middle]
+        node.left = self._build(nodes[:middle], 1 - axis)
+        node.right = self._build(nodes[middle + 1 :], 1 - axis)
+        node.size = len(nodes)
+        return node
+
+    def _live_nodes(self, root: Optional[_Node] = None) -> Iterator[_Node]:
+        root = root or self._root
+        stack = [root] if root else []
+        while stack:
+            node = stack.pop()
+            if not node.deleted:
+                yield node
+            stack.extend(child for child in (node.left, node.right) if child)
+
+    def __len__(self):
+        return self._size - self._deleted
+
+    def __iter__(self) -> Iterator[Any]:
+        return (node.point for node in self._live_nodes())
+
+    def __contains__(self, point: Any) -> bool:
+        return self._find(point) is not None
+
+    def _find(self, point: Any) -> Optional[_Node]:
+        x, y = point.x, point.y
+        stack = [(self._root, 0)]
+        while stack:
+            node, axis = stack.pop()
+            if node is None:
+                continue
+            if not node.deleted and node.x == x and node.y == y and node.point == point:
+                return node
+            # equal coordinates may have gone either way when the tree was built
+            key, split = (y, node.y) if axis else (x, node.x)
+            if key <= split:
+                stack.append((node.left, 1 - axis))
+            if key >= split:
+                stack.append((node.right, 1 - axis))
+        return None
+
+    def insert(self, point: Any) -> None:
+        new = _Node(point, point.x, point.y)
+        self._size += 1
+        if self._root is None:
+            self._root = new
+            return
+        path = []  # the nodes above new, with their axis
+        node, axis = self._root, 0
+        while node is not None:
+            path.append((node, axis))
+            node.size += 1
+            go_left = (new.y < node.y) if axis else (new.x < node.x)
+            node, axis = (node.left if go_left else node.right), 1 - axis
+        parent, axis = path[-1]
+        if (new.y < parent.y) if axis else (new.x < parent.x):
+            parent.left = new
+        else:
+            parent.right = new
+        if len(path) > math.log(self._size, 1 / ALPHA):
+            self._rebalance(path, new)
+
+    def _rebalance(self, path: List[Tuple[_Node, int]], new: _Node) -> None:
+        # the scapegoat is the lowest node on the path with a child too big for it,
+        # rebuilding its subtree costs O(size), paid for by the inserts that unbalanced it
+        child, index = new, 0
+        for index in range(len(path) - 1, -1, -1):
+            node = path[index][0]
+            if child.size > ALPHA * node.size:
+                break
+            child = node
+        scapegoat, axis = path[index]
+        nodes = list(self._live_nodes(scapegoat))
+        dropped = scapegoat.size - len(nodes)  # deleted nodes are left out of the new subtree
+        subtree = self._build(nodes, axis)
+        if index == 0:
+            self._root = subtree
+        else:
+            parent = path[index - 1][0]
+            if parent.left is scapegoat:
+                parent.left = subtree
+            else:
+                parent.right = subtree
+            for node, _ in path[:index]:
+                node.size -= dropped
+        self._size -= dropped
+        self._deleted -= dropped
+
+    def _height(self) -> int:
+        height, stack = 0, [(self._root, 1)] if self._root else []
+        while stack:
+            node, depth = stack.pop()
+            height = max(height, depth)
+            stack.extend((child, depth + 1) for child in (node.left, node.right) if child)
+        return height
+
+    def remove(self, point: Any) -> None:
+        node = self._find(point)
+        if node is None:
+            raise KeyError(point)
+        node.deleted = True
+        self._deleted += 1
+        if self._deleted > len(self):
+            self._rebuild(list(self._live_nodes()))
+
+    def discard(self, point: Any) -> None:
+        try:
+            self.remove(point)
+        except KeyError:
+            pass
+
+    def nearest(self, target: Any, k: int = 1) -> List[Any]:
+        # the k points closest to target, nearest first
+        tx, ty = target.x, target.y
+        best: List[Tuple[float, int, Any]] = []  # max-heap of the k best: (-distance², tiebreak, point)
+        counter = itertools.count()
+
+        def visit(node: Optional[_Node], axis: int) -> None:
+            if node is None:
+                return
+            if not node.deleted:
+                dist = (node.x - tx) ** 2 + (node.y - ty) ** 2
+                entry = (-dist, -next(counter), node.point)
+                if len(best) < k:
+                    heapq.heappush(best, entry)
+                elif dist < -best[0][0]:
+                    heapq.heapreplace(best, entry)
+            diff = (ty - node.y) if axis else (tx - node.x)
+            near, far = (node.left, node.right) if diff < 0 else (node.right, node.left)
+            visit(near, 1 - axis)
+            if len(best) < k or diff * diff < -best[0][0]:
+                visit(far, 1 - axis)
+
+        if k > 0:
+            visit(self._root, 0)
+        return [point for _, _, point in sorted(best, reverse=True)]
+
+    def within_radius(self, center: Any, radius: float) -> List[Any]:
+        cx, cy = center.x, center.y
+        limit = radius * radius
+        found = []
+        stack = [(self._root, 0)]
+        while stack:
+            node, axis = stack.pop()
+            if node is None:
+                continue
+            if not node.deleted and (node.x - cx) ** 2 + (node.y - cy) ** 2 <= limit:
+                found.append(node.point)
+            diff = (cy - node.y) if axis else (cx - node.x)
+            if diff <= radius:
+                stack.append((node.left, 1 - axis))
+            if diff >= -radius:
+                stack.append((node.right, 1 - axis))
+        return found
+
+    def in_box(self, x_min: float, y_min: float, x_max: float, y_max: float) -> List[Any]:
+        # points with x_min <= x <= x_max and y_min <= y <= y_max
+        found = []
+        stack = [(self._root, 0)]
+        while stack:
+            node, axis = stack.pop()
+            if node is None:
+                continue
+            if not node.deleted and x_min <= node.x <= x_max and y_min <= node.y <= y_max:
+                found.append(node.point)
+            low, high, split = (y_min, y_max, node.y) if axis else (x_min, x_max, node.x)
+            if low <= split:
+                stack.append((node.left, 1 - axis))
+            if high >= split:
+                stack.append((node.right, 1 - axis))
+        return found
+
+
+def brute_nearest(points, target, k):
+    return sorted(points, key=lambda p: (p.x - target.x) ** 2 + (p.y - target.y) ** 2)[:k]
+
+
+@pytest.fixture
+def points():
+    rnd = random.Random(7)
+    # a coarse grid has plenty of duplicated coordinates
+    return [Vector2d(rnd.randrange(50), rnd.randrange(50)) for _ in range(2000)]
+
+
+def distances(points, target):
+    return [abs(Vector2d(p.x - target.x, p.y - target.y)) for p in points]
+
+
+def test_kdtree_queries_match_linear_scan(points):
+    tree = KDTree(points)
+    assert len(tree) == len(points)
+    for target in [Vector2d(0, 0), Vector2d(25.5, 13.2), Vector2d(-10, 60)]:
+        got = tree.nearest(target, k=10)
+        assert distances(got, target) == distances(brute_nearest(points, target, 10), target)
+        assert sorted(map(tuple, tree.within_radius(target, 7.5))) == sorted(
+            tuple(p) for p in points if abs(Vector2d(p.x - target.x, p.y - target.y)) <= 7.5
+        )
+    assert sorted(map(tuple, tree.in_box(10, 20, 15, 22))) == sorted(
+        tuple(p) for p in points if 10 <= p.x <= 15 and 20 <= p.y <= 22
+    )
+
+
+def test_kdtree_insert_and_remove(points):
+    tree = KDTree()
+    for p in points:
+        tree.insert(p)
+    assert tree._height() <= math.log(len(tree), 1 / ALPHA) + 1
+    for p in points[:1500]:
+        tree.remove(p)
+    remaining = points[1500:]
+    assert len(tree) == 500
+    assert sorted(map(tuple, tree)) == sorted(map(tuple, remaining))
+    target = Vector2d(30, 30)
+    assert distances(tree.nearest(target, 5), target) == distances(
+        brute_nearest(remaining, target, 5), target
+    )
+    with pytest.raises(KeyError):
+        tree.remove(Vector2d(100, 100))
+
+
+def test_kdtree_inserts_rebuild_subtrees_only():
+    # a full rebuild every few inserts would make this quadratic: 16 times slower for 4 times
+    # the points, rebuilding only the unbalanced subtrees is O(n log n)
+    def insert_all(points):
+        tree = KDTree()
+        start = time.perf_counter()
+        for p in points:
+            tree.insert(p)
+        assert tree._height() <= math.log(len(tree), 1 / ALPHA) + 1
+        return time.perf_counter() - start
+
+    rnd = random.Random(7)
+    for order in (list, lambda p: rnd.sample(p, len(p))):  # sorted on x, and shuffled
+        small = min(insert_all(order([Vector2d(i, i % 7) for i in range(2000)])) for _ in range(3))
+        large = min(insert_all(order([Vector2d(i, i % 7) for i in range(8000)])) for _ in range(3))
+        assert large < 8 * small
+
+
+def test_kdtree_from_raw_coordinates():
+    coords = array("d", [0, 0, 3, 4, 10, 10])
+    tree = KDTree(coords)
+    assert tree.nearest(Vector2d(2, 2)) == [Vector2d(3, 4)]
+    assert Vector2d(10, 10) in tree
+    assert KDTree(Vector2dArray.frombytes(bytes(Vector2dArray([(1, 1)])))).nearest(
+        Vector2d(0, 0)
+    ) == [Vector2d(1, 1)]
@@ -0,0 +1,260 @@
+from array import array
+from collections.abc import Iterable, Iterator, Sequence
+from itertools import chain, repeat
+import math
+import mmap
+import os
+from typing import BinaryIO, Dict, List, Optional, Union
+import weakref
+
+import pytest
+
+from .a_pythonic_object import Vector2d
+
+
+# Vector2d.__bytes__ and Vector2d.frombytes work with one vector at a time
+# Vector2dArray keeps N vectors in one contiguous buffer of floats: x0, y0, x1, y1, ...
+# the serialized form is the same as for Vector2d - one typecode byte followed by the raw floats -
+# so bytes(Vector2d(3, 4)) is also a valid one element Vector2dArray
+# loading from bytes, a file or an mmap only casts a memoryview over the data,
+# Vector2d objects are created when elements are accessed
+# batch methods (magnitudes, angles, hashes, formats) compute the result of the scalar Vector2d method
+# for every vector in one call, mapping C functions over strided views of the x and y columns
+
+
+class Vector2dArray(Sequence):
+    typecode = "d"
+    vector_class = Vector2d
+
+    def __init__(
+        self, vectors: Iterable[Iterable[float]] = (), typecode: Optional[str] = None
+    ):
+        self.typecode = typecode or self.typecode
+        coords = array(self.typecode, chain.from_iterable(vectors))
+        self._owner: object = coords  # object exporting the buffer, kept alive with the view
+        # the views of the buffer handed out (slices, coords, xs, ys) while they are alive,
+        # by id, shared with the slices - memoryviews can't go in a WeakSet, they are unhashable
+        self._views: Dict[int, weakref.ref] = {}
+        self._coords = self._track(memoryview(coords))
+
+    def _track(self, view: memoryview) -> memoryview:
+        views, key = self._views, id(view)
+        views[key] = weakref.ref(view, lambda _: views.pop(key, None))
+        return view
+
+    @classmethod
+    def _from_buffer(cls, buffer, owner: object) -> "Vector2dArray":
+        typecode = chr(buffer[0])
+        coords = memoryview(buffer)[1:].cast(typecode)  # no copy, unlike Vector2d.frombytes
+        if len(coords) % 2:
+            raise ValueError("buffer holds an odd number of coordinates")
+        vectors = cls.__new__(cls)
+        vectors.typecode = typecode
+        vectors._owner = owner
+        vectors._views = {}
+        vectors._coords = vectors._track(coords)
+        return vectors
+
+    @classmethod
+    def frombytes(cls, octets: Union[bytes, bytearray, memoryview]) -> "Vector2dArray":
+        return cls._from_buffer(octets, octets)
+
+    @classmethod
+    def load(cls, fp: BinaryIO) -> "Vector2dArray":
+        return cls.frombytes(fp.read())  # one read for the whole file
+
+    @classmethod
+    def frommmap(cls, path: Union[str, os.PathLike]) -> "Vector2dArray":
+        # the OS pages the file in as elements are accessed, nothing is read up front
+        with open(path, "rb") as fp:
+            if not os.fstat(fp.fileno()).st_size:
+                return cls()  # an empty file can't be mapped
+            mapped = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls._from_buffer(mapped, mapped)
+
+    def tobytes(self) -> bytes:
+        return bytes([ord(self.typecode)]) + self._coords.tobytes()
+
+    def __bytes__(self):
+        return self.tobytes()
+
+    def dump(self, fp: BinaryIO) -> None:
+        fp.write(bytes([ord(self.typecode)]))
+        fp.write(self._coords)  # written straight from the buffer, without a copy
+
+    @property
+    def coords(self) -> memoryview:
+        # flat, read-only view of the coordinates: x0, y0, x1, y1, ...
+        return self._track(self._coords.toreadonly())
+
+    def __buffer__(self, flags: int) -> memoryview:
+        # buffer protocol for Python classes (PEP 688, Python 3.12+): memoryview(vectors)
+        return self._coords
+
+    def release(self) -> None:
+        # release the buffer, so that an mmap backing the array is closed right away
+        # the slices of the array and the views returned by coords, xs and ys share the buffer,
+        # they are released too; views the caller made from those keep the mmap open,
+        # it is then closed when garbage collected
+        for ref in list(self._views.values()):
+            view = ref()
+            if view is None:
+                continue
+            try:
+                view.release()
+            except BufferError:  # exported again, e.g. memoryview(vectors.coords)
+                pass
+        if isinstance(self._owner, mmap.mmap):
+            try:
+                self._owner.close()
+            except BufferError:
+                pass
+
+    def __len__(self):
+        return len(self._coords) // 2
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step == 1:
+                vectors = type(self).__new__(type(self))
+                vectors.typecode = self.typecode
+                vectors._owner = self._owner
+                vectors._views = self._views
+                vectors._coords = self._track(self._coords[2 * start : 2 * max(start, stop)])
+                return vectors
+            return type(self)((self[i] for i in range(start, stop, step)), self.typecode)
+        i = range(len(self))[index]  # handles negative indices and raises IndexError
+        return self.vector_class(self._coords[2 * i], self._coords[2 * i + 1])
+
+    def __iter__(self) -> Iterator[Vector2d]:
+        return map(self.vector_class, self._coords[0::2], self._coords[1::2])
+
+    @property
+    def xs(self) -> memoryview:
+        return self._track(self._coords[0::2])
+
+    @property
+    def ys(self) -> memoryview:
+        return self._track(self._coords[1::2])
+
+    def magnitudes(self) -> array:
+        # abs() of every vector
+        return array("d", map(math.hypot, self.xs, self.ys))
+
+    def angles(self) -> array:
+        # Vector2d.angle() of every vector
+        return array("d", map(math.atan2, self.ys, self.xs))
+
+    def hashes(self) -> List[int]:
+        # hash() of every vector, Vector2d hashes the (x, y) tuple
+        return list(map(hash, zip(self.xs, self.ys)))
+
+    def formats(self, format_spec: str = "") -> List[str]:
+        # format(vector, format_spec) of every vector, including the polar 'p' format
+        if format_spec.endswith("p"):
+            format_spec = format_spec[:-1]
+            first, second = self.magnitudes(), self.angles()
+            outer_fmt = "<{}, {}>"
+        else:
+            first, second = self.xs, self.ys
+            outer_fmt = "({}, {})"
+        return list(
+            map(
+                outer_fmt.format,
+                map(format, first, repeat(format_spec)),
+                map(format, second, repeat(format_spec)),
+            )
+        )
+
+    def __eq__(self, other):
+        if isinstance(other, Vector2dArray):
+            return self._coords == other._coords  # element-wise, also across typecodes
+        return NotImplemented
+
+    def __repr__(self):
+        class_name = type(self).__name__
+        return f"{class_name}(<{len(self)} vectors>, typecode={self.typecode!r})"
+
+
+def test_vector2d_array_bytes_roundtrip():
+    vectors = Vector2dArray([Vector2d(3, 4), Vector2d(1, 2), (0, -1)])
+    octets = bytes(vectors)
+    assert len(octets) == 1 + 3 * 2 * 8
+    restored = Vector2dArray.frombytes(octets)
+    assert restored == vectors
+    assert list(restored) == [Vector2d(3, 4), Vector2d(1, 2), Vector2d(0, -1)]
+    assert restored[-1] == Vector2d(0, -1)
+    with pytest.raises(IndexError):
+        restored[3]
+
+
+def test_vector2d_array_compatible_with_vector2d_bytes():
+    v = Vector2d(3, 4)
+    assert list(Vector2dArray.frombytes(bytes(v))) == [v]
+    assert Vector2d.frombytes(bytes(Vector2dArray([v]))) == v
+
+
+def test_vector2d_array_slices_share_buffer():
+    vectors = Vector2dArray((i, -i) for i in range(10))
+    part = vectors[2:5]
+    assert list(part) == [Vector2d(2, -2), Vector2d(3, -3), Vector2d(4, -4)]
+    assert part.coords.obj is vectors.coords.obj
+    assert list(vectors[::4]) == [Vector2d(0, 0), Vector2d(4, -4), Vector2d(8, -8)]
+
+
+def test_vector2d_array_dump_load_and_mmap(tmp_path):
+    vectors = Vector2dArray([(i, i / 2) for i in range(1000)], typecode="f")
+    path = tmp_path / "vectors.bin"
+    with open(path, "wb") as fp:
+        vectors.dump(fp)
+    with open(path, "rb") as fp:
+        assert Vector2dArray.load(fp) == vectors
+    mapped = Vector2dArray.frommmap(path)
+    assert mapped.typecode == "f"
+    assert mapped[999] == Vector2d(999, 499.5)
+    assert mapped == vectors
+    mapped.release()
+
+
+def test_vector2d_array_release_with_slices(tmp_path):
+    path = tmp_path / "vectors.bin"
+    with open(path, "wb") as fp:
+        Vector2dArray([(i, i) for i in range(10)]).dump(fp)
+    mapped = Vector2dArray.frommmap(path)
+    part, xs = mapped[2:5], mapped.xs
+    assert list(part) == [Vector2d(2, 2), Vector2d(3, 3), Vector2d(4, 4)]
+    mapped.release()  # part and xs share the mmap
+    assert mapped._owner.closed
+    with pytest.raises(ValueError):
+        len(part)
+    with pytest.raises(ValueError):
+        xs[0]
+    kept = Vector2dArray.frommmap(path)
+    held = memoryview(kept.coords)  # a view the array doesn't know of
+    kept.release()  # doesn't raise, the mmap stays open for held
+    assert held[2] == 1.0
+    held.release()
+
+
+def test_vector2d_array_mmap_empty_file(tmp_path):
+    path = tmp_path / "empty.bin"
+    path.write_bytes(b"")
+    assert len(Vector2dArray.frommmap(path)) == 0
+
+
+@pytest.mark.parametrize("typecode", ["d", "f"])
+def test_vector2d_array_batch_methods_match_scalar(typecode):
+    coords = [(3, 4), (0, 0), (-1.5, 2.25), (1e-300, -7), (0.1, 0.2), (-0.0, -3)]
+    vectors = Vector2dArray(coords, typecode)
+    scalars = list(vectors)
+    assert list(vectors.magnitudes()) == [abs(v) for v in scalars]
+    assert list(vectors.angles()) == [v.angle() for v in scalars]
+    assert vectors.hashes() == [hash(v) for v in scalars]
+    for spec in ["", ".2f", ".3e", "p", "0.3p"]:
+        assert vectors.formats(spec) == [format(v, spec) for v in scalars]
+
+
+def test_vector2d_array_odd_buffer():
+    with pytest.raises(ValueError):
+        Vector2dArray.frombytes(b"d" + bytes(array("d", [1.0])))
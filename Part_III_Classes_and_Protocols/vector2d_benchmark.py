@@ -0,0 +1,51 @@
+# microbenchmark of the Vector2d fast paths for set and dict heavy workloads
+# LegacyVector2d restores the original generator based __iter__, __eq__ and __hash__
+# run as a module: python -m Part_III_Classes_and_Protocols.vector2d_benchmark
+
+import random
+import timeit
+
+from .a_pythonic_object import Vector2d
+
+
+class LegacyVector2d(Vector2d):
+    __slots__ = ()
+
+    def __iter__(self):
+        return (i for i in (self.x, self.y))
+
+    def __eq__(self, other):
+        return tuple(self) == tuple(other)
+
+    def __hash__(self):
+        return hash((self.x, self.y))
+
+
+def workloads(cls, points):
+    vectors = [cls(x, y) for x, y in points]
+    probes = [cls(x, y) for x, y in points]  # equal values, but different objects
+    index = {v: i for i, v in enumerate(vectors)}
+    members = set(vectors)
+    return {
+        "dict build": lambda: {v: i for i, v in enumerate(vectors)},
+        "dict lookup": lambda: [index[v] for v in probes],
+        "set membership": lambda: [v in members for v in probes],
+        "equality": lambda: [a == b for a, b in zip(vectors, probes)],
+        "unpacking": lambda: [x + y for x, y in vectors],
+    }
+
+
+def main(size: int = 100_000, repeat: int = 5):
+    rnd = random.Random(0)
+    points = [(rnd.randrange(1000), rnd.randrange(1000)) for _ in range(size)]
+    legacy = workloads(LegacyVector2d, points)
+    current = workloads(Vector2d, points)
+    print(f"{'workload':<16} {'legacy':>10} {'current':>10} {'speedup':>8}")
+    for name in current:
+        before = min(timeit.repeat(legacy[name], number=1, repeat=repeat))
+        after = min(timeit.repeat(current[name], number=1, repeat=repeat))
+        print(f"{name:<16} {before:>9.4f}s {after:>9.4f}s {before / after:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
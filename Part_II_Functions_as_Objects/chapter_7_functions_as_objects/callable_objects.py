@@ -17,6 +17,8 @@
 
 import random
 
+import pytest
+
 class BingoCage:
 
     def __init__(self, items):
@@ -32,6 +34,66 @@ class BingoCage:
     def __call__(self):
         return self.pick()
 
+# BingoCage copies and shuffles all items up front, which is a waste when only a few are drawn from a big range
+# LazyBingoCage does one step of Fisher-Yates per pick: a random item among the ones not drawn yet
+# is taken, and the last of them is moved into its place
+# the moved items are kept in a dict, so the memory used grows with the number of picks, not with the items
+# immutable sequences (range, tuple, str) are used as they are, anything else is copied like BingoCage does:
+# a list cleared or changed by the caller would change the cage behind its back
+
+class LazyBingoCage:
+
+    def __init__(self, items):
+        self._items = items if isinstance(items, (range, tuple, str)) else list(items)
+        self._remaining = len(self._items)
+        self._moved = {}  # position -> item moved there from the end
+
+    def _item_at(self, position):
+        if position in self._moved:
+            return self._moved[position]
+        return self._items[position]
+
+    def pick(self):
+        if not self._remaining:
+            raise LookupError('pick from empty BingoCage')
+        last = self._remaining - 1
+        position = random.randrange(self._remaining)
+        item = self._item_at(position)
+        if position != last:
+            self._moved[position] = self._item_at(last)
+        self._moved.pop(last, None)
+        self._remaining = last
+        return item
+
+    def pick_many(self, k):
+        if k > self._remaining:
+            raise LookupError(f'pick of {k} items from BingoCage with {self._remaining} left')
+        return [self.pick() for _ in range(k)]
+
+    def __len__(self):
+        return self._remaining
+
+    def __call__(self):
+        return self.pick()
+
+def test_lazy_bingo_cage_picks_every_item_once():
+    cage = LazyBingoCage(range(100))
+    assert sorted(cage.pick_many(100)) == list(range(100))
+    assert len(cage) == 0
+    with pytest.raises(LookupError):
+        cage()
+
+
+def test_lazy_bingo_cage_copies_mutable_items():
+    items = [1, 2, 3]
+    cage = LazyBingoCage(items)
+    items.clear()
+    assert len(cage) == 3
+    assert sorted(cage.pick_many(3)) == [1, 2, 3]
+    huge = range(10**12)
+    assert LazyBingoCage(huge)._items is huge  # not copied
+
+
 if __name__ == '__main__':
     bingo = BingoCage([1, 2, 3, 4, 5])
     print(bingo.pick())
@@ -39,3 +101,9 @@ if __name__ == '__main__':
     print(callable(bingo))  # prints True - bingo is callable
     print(callable(bingo.pick))  # prints True - bingo.pick is callable
     print(callable(BingoCage))  # prints True - BingoCage is callable
+
+    raffle = LazyBingoCage(range(10**9))  # nothing is copied
+    print(raffle.pick_many(5))
+    print(len(raffle))  # 999999995
+    small = LazyBingoCage('abc')
+    print(sorted(small.pick_many(3)))  # ['a', 'b', 'c'] - every item exactly once
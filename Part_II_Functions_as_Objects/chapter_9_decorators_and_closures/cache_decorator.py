@@ -84,8 +84,20 @@ def _(x) -> str:
     return f"<pre>{frac.numerator}/{frac.denominator}</pre>"
 
 
+# limit_denominator is slow, and tables of numbers repeat the same values: another use case for lru_cache
+# the cache is keyed on the type and the text of the number, not on the number:
+# 0.5 == Decimal("0.50") and 0.0 == -0.0, but they are written differently
+@functools.lru_cache(maxsize=65536)
+def approximate(cls: type, text: str) -> str:
+    frac = fractions.Fraction(cls(text)).limit_denominator()  # the text of a float or Decimal round-trips
+    return f"<pre>{text} ({frac.numerator}/{frac.denominator})</pre>"
+
+
 @htmlize.register(decimal.Decimal)
 @htmlize.register(float)
 def _(x) -> str:
-    frac = fractions.Fraction(x).limit_denominator()
+    cls = type(x)
+    if cls is float or cls is decimal.Decimal:
+        return approximate(cls, f"{x}")
+    frac = fractions.Fraction(x).limit_denominator()  # subclasses may not round-trip through their text
     return f"<pre>{x} ({frac.numerator}/{frac.denominator})</pre>"
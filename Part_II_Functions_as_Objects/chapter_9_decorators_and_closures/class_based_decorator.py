@@ -2,24 +2,58 @@
 import functools
 import time
 
+from .clock_metrics import is_stepped, metrics, qualified_name, timed_steps
+from .clock_recorder import ClockRecorder
+
 DEFAULT_FMT = "[{elapsed:0.8f}s] {name}({args}) -> {result}"
+# coroutines and generators also have {running} and {suspended} time
+# with recursive=True only top-level calls are printed, exclusive and calls aggregate the recursion
+RECURSIVE_FMT = (
+    "[{elapsed:0.8f}s inclusive, {exclusive:0.8f}s exclusive, {calls} calls] "
+    "{name}({args}) -> {result}"
+)
 
 
 class Clock:
 
-    def __init__(self, fmt: str = DEFAULT_FMT):
-        self.fmt = fmt
+    def __init__(
+        self,
+        fmt: str | None = None,
+        recorder: ClockRecorder | None = None,
+        sample_every: int = 1,
+        recursive: bool = False,
+    ):
+        self.fmt = fmt or (RECURSIVE_FMT if recursive else DEFAULT_FMT)
+        self.recursive = recursive
+        self.recorder = recorder  # when set, calls are recorded instead of printed
+        self.sample_every = sample_every
 
     def __call__(self, func):
-        @functools.wraps(func)
-        def clocked(*_args):
-            t0 = time.time()
-            _result = func(*_args)
-            elapsed = time.time() - t0
+        if self.recorder is not None:
+            return self.recorder.wrap(func, self.sample_every)
+        key = qualified_name(func)
+
+        def report(timer, _args, _kwargs, _result):
+            if self.recursive and not timer.top_level:
+                return
+            elapsed = timer.elapsed
+            exclusive = timer.exclusive
+            calls = timer.calls
+            running = getattr(timer, "running", elapsed)
+            suspended = getattr(timer, "suspended", 0.0)
             name = func.__name__
             args = ", ".join(repr(arg) for arg in _args)
             result = repr(_result)
             print(self.fmt.format(**locals()))
+
+        if is_stepped(func):
+            return timed_steps(func, key, report)
+
+        @functools.wraps(func)
+        def clocked(*_args):
+            with metrics.timer(key) as timer:
+                _result = func(*_args)
+            report(timer, _args, {}, _result)
             return _result
 
         return clocked
@@ -41,3 +75,38 @@ def test_class_based_deco():
 
     for i in range(3):
         snooze2(0.123)
+
+
+def test_class_based_deco_recorder(capsys):
+    recorder = ClockRecorder()
+
+    @Clock(recorder=recorder, sample_every=2)
+    def snooze3(seconds):
+        time.sleep(seconds)
+
+    for i in range(4):
+        snooze3(0.01)
+    assert capsys.readouterr().out == ""
+    assert recorder.report("{name}({args})") == ["snooze3(0.01)", "snooze3(0.01)"]
+
+
+def test_class_based_deco_recursive(capsys):
+    @Clock(recursive=True)
+    def factorial(n):
+        return 1 if n < 2 else n * factorial(n - 1)
+
+    factorial(6)
+    out = capsys.readouterr().out
+    assert out.count("\n") == 1
+    assert "exclusive, 6 calls] factorial(6) -> 720" in out
+
+
+def test_class_based_deco_async(capsys):
+    import asyncio
+
+    @Clock("{name}({args}) suspended={suspended:0.1f}s")
+    async def snooze4(seconds):
+        await asyncio.sleep(seconds)
+
+    asyncio.run(snooze4(0.1))
+    assert capsys.readouterr().out == "snooze4(0.1) suspended=0.1s\n"
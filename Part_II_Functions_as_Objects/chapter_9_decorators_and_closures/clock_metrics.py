@@ -0,0 +1,536 @@
+# global registry of call timings for all clocked functions
+# clock, better_clock, Clock, the parametrized clock(fmt) and ClockRecorder all time calls with
+# metrics.timer(name), so the measurements are aggregated here instead of being printed and lost
+# for every function the registry keeps the number of calls, total time, self time (total time minus
+# the time spent in other clocked functions called from it) and p50/p95/p99 latency
+# snapshot() returns the numbers, to_json() and to_prometheus() export them
+# recursive calls are aggregated into the outermost call of the same function (the top-level call):
+# total time and latency count only top-level calls, so nested frames are not counted twice,
+# while calls and self time include every frame
+# callers timing only 1 in N calls pass weight=N, every timed call then counts as N calls
+# with collect_stacks=True the self time is also kept per call stack, collapsed() exports it
+# in the collapsed stack format read by flame graph tools
+# coroutine functions, async generators and generators are timed by timed_steps():
+# from the call to completion, split in time spent running and time spent suspended
+import asyncio
+import functools
+import inspect
+import json
+import math
+import threading
+import time
+import types
+from collections import Counter
+from typing import Any, Callable, Generator, Optional
+
+import pytest
+
+
+class QuantileSketch:
+    # streaming quantiles in constant memory, with relative accuracy (like DDSketch)
+    # values are counted in logarithmic buckets: bucket i holds values in (gamma ** (i-1), gamma ** i],
+    # so any quantile is estimated within relative_accuracy of the true value
+
+    def __init__(self, relative_accuracy: float = 0.01):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self._buckets: Counter[int] = Counter()
+        self._zeros = 0
+        self.count = 0
+
+    def add(self, value: float, count: int = 1) -> None:
+        self.count += count
+        if value <= 0:
+            self._zeros += count
+        else:
+            self._buckets[math.ceil(math.log(value) / self._log_gamma)] += count
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return math.nan
+        rank = q * (self.count - 1)
+        seen = self._zeros
+        if rank < seen:
+            return 0.0
+        for index in sorted(self._buckets):
+            seen += self._buckets[index]
+            if rank < seen:
+                return 2 * self.gamma**index / (self.gamma + 1)
+        return 2 * self.gamma ** max(self._buckets) / (self.gamma + 1)
+
+
+class FunctionStats:
+    # calls counts every frame, recursive ones included; top_level_calls counts the calls
+    # the latency sketch and total describe
+    __slots__ = ("calls", "top_level_calls", "total", "self_total", "suspended_total", "sketch")
+
+    def __init__(self):
+        self.calls = 0
+        self.top_level_calls = 0
+        self.total = 0.0
+        self.self_total = 0.0
+        self.suspended_total = 0.0
+        self.sketch = QuantileSketch()
+
+
+class Timer:
+    # context manager measuring one call; nested timers on the same thread form a stack,
+    # which is how the time of a call is subtracted from the self time of its caller
+    # the outermost timer of a function (outer is None) aggregates its recursive calls:
+    # after exit, elapsed is the inclusive time, exclusive the self time of all frames, calls their number
+
+    __slots__ = (
+        "registry",
+        "name",
+        "child_time",
+        "elapsed",
+        "exclusive",
+        "calls",
+        "outer",
+        "path",
+        "weight",
+        "_t0",
+    )
+
+    def __init__(self, registry: "MetricsRegistry", name: str, weight: int = 1):
+        self.registry = registry
+        self.name = name
+        self.weight = weight
+        self.child_time = 0.0
+        self.elapsed = 0.0
+        self.exclusive = 0.0
+        self.calls = 0
+        self.path = name
+
+    @property
+    def top_level(self) -> bool:
+        return self.outer is None
+
+    def __enter__(self) -> "Timer":
+        state = self.registry._state()
+        stack, active = state.stack, state.active
+        self.outer = active.get(self.name)
+        if self.outer is None:
+            active[self.name] = self
+        if self.registry.collect_stacks:
+            self.path = f"{stack[-1].path};{self.name}" if stack else self.name
+        stack.append(self)
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.elapsed = time.perf_counter() - self._t0
+        state = self.registry._state()
+        state.stack.pop()
+        if state.stack:
+            state.stack[-1].child_time += self.elapsed
+        self_time = self.elapsed - self.child_time
+        if self.registry.collect_stacks:
+            self.registry._add_stack(self.path, self_time)
+        aggregate = self if self.outer is None else self.outer
+        aggregate.exclusive += self_time
+        aggregate.calls += 1
+        if self.outer is None:
+            del state.active[self.name]
+            self.registry.observe(
+                self.name, self.elapsed, self.exclusive, self.calls, weight=self.weight
+            )
+
+
+class _ThreadState(threading.local):
+    def __init__(self):
+        self.stack: list[Timer] = []
+        self.active: dict[str, Timer] = {}  # function name -> its outermost running timer
+
+
+class MetricsRegistry:
+    quantiles = (0.5, 0.95, 0.99)
+
+    def __init__(self, collect_stacks: bool = False):
+        self.collect_stacks = collect_stacks
+        self._stats: dict[str, FunctionStats] = {}
+        self._stacks: Counter[str] = Counter()  # call stack -> self time in seconds
+        self._lock = threading.Lock()
+        self._local = _ThreadState()
+
+    def _state(self) -> _ThreadState:
+        return self._local
+
+    def timer(self, name: str, weight: int = 1) -> Timer:
+        return Timer(self, name, weight)
+
+    def observe(
+        self,
+        name: str,
+        elapsed: float,
+        self_time: Optional[float] = None,
+        calls: int = 1,
+        suspended: float = 0.0,
+        weight: int = 1,
+    ) -> None:
+        # one top-level call, which may include calls - 1 recursive calls
+        # a sampled call, timed 1 in weight times, counts for weight calls that took as long
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = self._stats[name] = FunctionStats()
+            stats.calls += calls * weight
+            stats.top_level_calls += weight
+            stats.total += elapsed * weight
+            stats.self_total += (elapsed if self_time is None else self_time) * weight
+            stats.suspended_total += suspended * weight
+            stats.sketch.add(elapsed, weight)
+
+    def _add_stack(self, path: str, self_time: float) -> None:
+        with self._lock:
+            self._stacks[path] += self_time
+
+    def collapsed(self) -> str:
+        # one "outer;inner;innermost <microseconds>" line per call stack, for flamegraph.pl or speedscope
+        with self._lock:
+            return "".join(
+                f"{path} {round(seconds * 1e6)}\n" for path, seconds in sorted(self._stacks.items())
+            )
+
+    def snapshot(self) -> dict[str, dict[str, float]]:
+        with self._lock:
+            return {
+                name: {
+                    "calls": stats.calls,
+                    "top_level_calls": stats.top_level_calls,
+                    "total_seconds": stats.total,
+                    "self_seconds": stats.self_total,
+                    "suspended_seconds": stats.suspended_total,
+                    **{f"p{q * 100:g}": stats.sketch.quantile(q) for q in self.quantiles},
+                }
+                for name, stats in self._stats.items()
+            }
+
+    def to_json(self, **kwargs: Any) -> str:
+        return json.dumps(self.snapshot(), **kwargs)
+
+    def to_prometheus(self, prefix: str = "clock") -> str:
+        # Prometheus text exposition format
+        lines = [
+            f"# HELP {prefix}_self_seconds_total Time spent in the function, without clocked callees.",
+            f"# TYPE {prefix}_self_seconds_total counter",
+        ]
+        snapshot = self.snapshot()
+        for name, values in snapshot.items():
+            label = f'function="{_escape(name)}"'
+            lines.append(f"{prefix}_self_seconds_total{{{label}}} {values['self_seconds']!r}")
+        lines += [
+            f"# HELP {prefix}_calls_total Calls of clocked functions, recursive calls included.",
+            f"# TYPE {prefix}_calls_total counter",
+        ]
+        for name, values in snapshot.items():
+            label = f'function="{_escape(name)}"'
+            lines.append(f"{prefix}_calls_total{{{label}}} {values['calls']}")
+        lines += [
+            f"# HELP {prefix}_suspended_seconds_total Time coroutines and generators spent suspended.",
+            f"# TYPE {prefix}_suspended_seconds_total counter",
+        ]
+        for name, values in snapshot.items():
+            label = f'function="{_escape(name)}"'
+            lines.append(
+                f"{prefix}_suspended_seconds_total{{{label}}} {values['suspended_seconds']!r}"
+            )
+        lines += [
+            f"# HELP {prefix}_latency_seconds Call latency of clocked functions.",
+            f"# TYPE {prefix}_latency_seconds summary",
+        ]
+        for name, values in snapshot.items():
+            label = f'function="{_escape(name)}"'
+            for q in self.quantiles:
+                value = values[f"p{q * 100:g}"]
+                lines.append(f'{prefix}_latency_seconds{{{label},quantile="{q}"}} {value!r}')
+            lines.append(f"{prefix}_latency_seconds_sum{{{label}}} {values['total_seconds']!r}")
+            count = values["top_level_calls"]  # the calls summed up in _sum
+            lines.append(f"{prefix}_latency_seconds_count{{{label}}} {count}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats.clear()
+            self._stacks.clear()
+
+
+class StepTimer(Timer):
+    # timer of a coroutine or generator call, which runs in steps until it completes
+    # it is on the timer stack only while a step runs - between steps other code runs on the thread,
+    # and it is not aggregated like recursive calls: concurrent tasks of one coroutine function
+    # are separate calls, not calls nested in each other
+    # after finish(), elapsed is the wall time from the call, running + suspended == elapsed
+
+    __slots__ = ("running", "suspended", "_started")
+
+    def __init__(self, registry: "MetricsRegistry", name: str, weight: int = 1):
+        super().__init__(registry, name, weight)
+        self.outer = None
+        self.running = 0.0
+        self.suspended = 0.0
+        self._started = time.perf_counter()
+
+    def __enter__(self) -> "StepTimer":
+        stack = self.registry._state().stack
+        if self.registry.collect_stacks:
+            self.path = f"{stack[-1].path};{self.name}" if stack else self.name
+        stack.append(self)
+        self.exclusive = self.child_time  # child time before this step, see __exit__
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        step = time.perf_counter() - self._t0
+        self.running += step
+        stack = self.registry._state().stack
+        stack.pop()
+        if stack:
+            stack[-1].child_time += step
+        if self.registry.collect_stacks:
+            self.registry._add_stack(self.path, step - (self.child_time - self.exclusive))
+
+    def finish(self) -> None:
+        self.elapsed = time.perf_counter() - self._started
+        self.suspended = self.elapsed - self.running
+        self.exclusive = self.running - self.child_time
+        self.calls = 1
+        self.registry.observe(
+            self.name, self.elapsed, self.exclusive, 1, self.suspended, self.weight
+        )
+
+
+def _step_through(iterator: Generator, timer: StepTimer) -> Generator:
+    # drives a generator (or the iterator of an awaitable) one step at a time, timing every step,
+    # and passes values, exceptions and close() between it and whoever drives this generator
+    value, error = None, None
+    while True:
+        with timer:
+            try:
+                if error is None:
+                    signal = iterator.send(value)
+                else:
+                    signal = iterator.throw(error)
+            except StopIteration as stop:
+                return stop.value
+        try:
+            value, error = (yield signal), None
+        except GeneratorExit:
+            iterator.close()
+            raise
+        except BaseException as exc:  # including asyncio.CancelledError
+            value, error = None, exc
+
+
+_await_steps = types.coroutine(_step_through)  # the same, as an awaitable
+
+Report = Callable[[StepTimer, tuple, dict, Any], None]
+
+
+def is_stepped(func: Callable[..., Any]) -> bool:
+    return (
+        inspect.iscoroutinefunction(func)
+        or inspect.isasyncgenfunction(func)
+        or inspect.isgeneratorfunction(func)
+    )
+
+
+def timed_steps(
+    func: Callable[..., Any],
+    name: str,
+    report: Report,
+    registry: Optional["MetricsRegistry"] = None,
+    weight: int = 1,
+) -> Callable[..., Any]:
+    # wrapper for coroutine functions, async generator functions and generator functions
+    # - coroutine: timed until the awaited result is ready, report gets the result
+    # - generator: timed until exhausted, report gets its return value
+    # - async generator: timed until exhausted, report gets None; values sent with asend() are not passed on
+    # every call is observed by the registry, report is only called when the call completes normally
+    registry = registry or metrics
+
+    if inspect.iscoroutinefunction(func):
+
+        @functools.wraps(func)
+        async def clocked(*args, **kwargs):
+            timer = StepTimer(registry, name, weight)
+            try:
+                result = await _await_steps(func(*args, **kwargs).__await__(), timer)
+            finally:
+                timer.finish()
+            report(timer, args, kwargs, result)
+            return result
+
+    elif inspect.isasyncgenfunction(func):
+
+        @functools.wraps(func)
+        async def clocked(*args, **kwargs):
+            timer = StepTimer(registry, name, weight)
+            agen = func(*args, **kwargs)
+            try:
+                while True:
+                    try:
+                        item = await _await_steps(agen.__anext__().__await__(), timer)
+                    except StopAsyncIteration:
+                        break
+                    yield item
+            finally:
+                await agen.aclose()
+                timer.finish()
+            report(timer, args, kwargs, None)
+
+    elif inspect.isgeneratorfunction(func):
+
+        @functools.wraps(func)
+        def clocked(*args, **kwargs):
+            timer = StepTimer(registry, name, weight)
+            try:
+                result = yield from _step_through(func(*args, **kwargs), timer)
+            finally:
+                timer.finish()
+            report(timer, args, kwargs, result)
+            return result
+
+    else:
+        raise TypeError(f"{func!r} is not a coroutine, async generator or generator function")
+    return clocked
+
+
+def _escape(label_value: str) -> str:
+    return label_value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def qualified_name(func: Any) -> str:
+    return f"{func.__module__}.{func.__qualname__}"
+
+
+metrics = MetricsRegistry()  # the registry all clock decorators report into
+
+
+def test_quantile_sketch_relative_accuracy():
+    sketch = QuantileSketch(relative_accuracy=0.01)
+    values = [i / 1000 for i in range(1, 10001)]
+    for value in values:
+        sketch.add(value)
+    for q in (0.5, 0.95, 0.99):
+        exact = values[round(q * (len(values) - 1))]
+        assert abs(sketch.quantile(q) - exact) <= 0.011 * exact
+
+
+def test_registry_self_time_and_export():
+    registry = MetricsRegistry()
+
+    def outer():
+        with registry.timer("outer"):
+            time.sleep(0.02)
+            for _ in range(2):
+                with registry.timer("inner"):
+                    time.sleep(0.01)
+
+    outer()
+    snapshot = registry.snapshot()
+    assert snapshot["outer"]["calls"] == 1 and snapshot["inner"]["calls"] == 2
+    outer_stats = snapshot["outer"]
+    assert outer_stats["total_seconds"] >= 0.04
+    assert 0.02 <= outer_stats["self_seconds"] < outer_stats["total_seconds"] - 0.02
+    assert json.loads(registry.to_json())["inner"]["calls"] == 2
+    text = registry.to_prometheus()
+    assert 'clock_latency_seconds_count{function="inner"} 2' in text
+    assert 'clock_latency_seconds{function="outer",quantile="0.99"}' in text
+
+
+def test_recursive_calls_aggregate_into_top_level_call():
+    registry = MetricsRegistry(collect_stacks=True)
+    top_level = []
+
+    def countdown(n):
+        with registry.timer("countdown") as timer:
+            time.sleep(0.001)
+            if n:
+                countdown(n - 1)
+        if timer.top_level:
+            top_level.append(timer)
+
+    countdown(4)
+    countdown(2)
+    assert [timer.calls for timer in top_level] == [5, 3]
+    first = top_level[0]
+    assert first.exclusive == pytest.approx(first.elapsed, rel=0.05)
+    stats = registry.snapshot()["countdown"]
+    assert stats["calls"] == 8 and stats["top_level_calls"] == 2
+    assert stats["total_seconds"] == pytest.approx(
+        first.elapsed + top_level[1].elapsed
+    )  # nested frames are not counted again
+    text = registry.to_prometheus()
+    assert 'clock_latency_seconds_count{function="countdown"} 2' in text
+    assert 'clock_calls_total{function="countdown"} 8' in text
+    stacks = [line.split()[0] for line in registry.collapsed().splitlines()]
+    assert stacks == [";".join(["countdown"] * depth) for depth in range(1, 6)]
+
+
+def test_timed_steps_coroutine_running_and_suspended():
+    registry = MetricsRegistry()
+    reports = []
+
+    async def fetch(delay):
+        await asyncio.sleep(delay)
+        time.sleep(0.01)  # blocking, counted as running
+        return delay
+
+    clocked = timed_steps(fetch, "fetch", lambda *call: reports.append(call), registry)
+
+    async def main():
+        return await asyncio.gather(clocked(0.05), clocked(0.02))
+
+    assert asyncio.run(main()) == [0.05, 0.02]
+    assert [args for _, args, _, _ in reports] == [(0.02,), (0.05,)]
+    timer = reports[1][0]
+    assert timer.elapsed >= 0.05
+    assert 0.01 <= timer.running < 0.03
+    assert timer.suspended == pytest.approx(timer.elapsed - timer.running)
+    assert registry.snapshot()["fetch"]["calls"] == 2
+
+
+def test_timed_steps_cancellation():
+    registry = MetricsRegistry()
+    reports = []
+    clocked = timed_steps(asyncio.sleep, "sleep", lambda *call: reports.append(call), registry)
+
+    async def main():
+        task = asyncio.create_task(clocked(10))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    assert reports == []  # not completed, but still observed
+    assert registry.snapshot()["sleep"]["calls"] == 1
+
+
+def test_timed_steps_generators():
+    registry = MetricsRegistry()
+    reports = []
+
+    def countdown(n):
+        while n:
+            yield n
+            n -= 1
+        return "done"
+
+    async def acountdown(n):
+        for i in countdown(n):
+            await asyncio.sleep(0)
+            yield i
+
+    gen = timed_steps(countdown, "countdown", lambda *call: reports.append(call), registry)
+    agen = timed_steps(acountdown, "acountdown", lambda *call: reports.append(call), registry)
+    assert list(gen(3)) == [3, 2, 1]
+    assert reports[0][3] == "done"
+
+    async def consume():
+        return [i async for i in agen(3)]
+
+    assert asyncio.run(consume()) == [3, 2, 1]
+    assert reports[1][1] == (3,)
+    assert set(registry.snapshot()) == {"countdown", "acountdown"}
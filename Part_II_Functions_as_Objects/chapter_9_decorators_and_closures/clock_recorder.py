@@ -0,0 +1,147 @@
+# non-printing mode for the clock decorators
+# better_clock and Clock print a formatted line for every call - too slow for hot functions,
+# and recursive functions like factorial flood stdout
+# ClockRecorder keeps the measurements in memory instead:
+# - the last `capacity` calls in a ring buffer, formatted only when report() is called
+# - a histogram of elapsed times in power of two buckets, per function
+# - sample_every=N times only 1 in N calls, the others call the function directly;
+#   the registry counts every sampled call as N calls, so its call counts and totals estimate
+#   all the calls, while records and histograms hold the sampled calls only
+# - when disabled, a clocked call costs one attribute check
+import functools
+import itertools
+import math
+from collections import Counter, deque
+from typing import Any, Callable, NamedTuple
+
+from .clock_metrics import is_stepped, metrics, qualified_name, timed_steps
+
+DEFAULT_FMT = "[{elapsed:0.8f}s] {name}({args}) -> {result}"
+
+
+class ClockRecord(NamedTuple):
+    name: str
+    elapsed: float
+    args: tuple
+    kwargs: dict
+    result: Any
+
+
+class ClockRecorder:
+
+    def __init__(self, capacity: int = 1024, enabled: bool = True, keep_args: bool = True):
+        self.enabled = enabled
+        self.keep_args = keep_args  # False doesn't keep references to arguments and results
+        self._records: deque[ClockRecord] = deque(maxlen=capacity)
+        self._buckets: Counter[tuple[str, int]] = Counter()
+
+    def record(self, name: str, elapsed: float, args: tuple, kwargs: dict, result: Any) -> None:
+        if not self.keep_args:
+            args, kwargs, result = (), {}, None
+        self._records.append(ClockRecord(name, elapsed, args, kwargs, result))
+        self._buckets[name, math.frexp(elapsed)[1]] += 1  # elapsed < 2 ** exponent
+
+    def wrap(self, func: Callable[..., Any], sample_every: int = 1) -> Callable[..., Any]:
+        calls = itertools.count()
+        name = func.__name__
+        key = qualified_name(func)
+
+        if is_stepped(func):
+            timed = timed_steps(
+                func,
+                key,
+                lambda timer, *call: self.record(name, timer.elapsed, *call),
+                weight=sample_every,
+            )
+
+            @functools.wraps(func)
+            def clocked_steps(*args, **kwargs) -> Any:
+                if not self.enabled or next(calls) % sample_every:
+                    return func(*args, **kwargs)
+                return timed(*args, **kwargs)
+
+            return clocked_steps
+
+        @functools.wraps(func)
+        def clocked(*args, **kwargs) -> Any:
+            if not self.enabled or next(calls) % sample_every:
+                return func(*args, **kwargs)
+            with metrics.timer(key, sample_every) as timer:
+                result = func(*args, **kwargs)
+            self.record(name, timer.elapsed, args, kwargs, result)
+            return result
+
+        return clocked
+
+    def __len__(self):
+        return len(self._records)
+
+    def records(self) -> list[ClockRecord]:
+        return list(self._records)
+
+    def histogram(self, name: str) -> dict[float, int]:
+        # upper bound of the bucket in seconds -> number of recorded calls
+        return {
+            2.0**exponent: count
+            for (func_name, exponent), count in sorted(self._buckets.items())
+            if func_name == name
+        }
+
+    def report(self, fmt: str = DEFAULT_FMT) -> list[str]:
+        lines = []
+        for name, elapsed, _args, kwargs, _result in self._records:
+            arg_lst = [repr(arg) for arg in _args]
+            arg_lst.extend(f"{k}={v!r}" for k, v in kwargs.items())
+            args = ", ".join(arg_lst)
+            result = repr(_result)
+            lines.append(fmt.format(name=name, elapsed=elapsed, args=args, result=result))
+        return lines
+
+    def clear(self) -> None:
+        self._records.clear()
+        self._buckets.clear()
+
+
+def test_recorder_keeps_last_calls():
+    recorder = ClockRecorder(capacity=3)
+
+    @recorder.wrap
+    def square(n: int) -> int:
+        return n * n
+
+    assert [square(n) for n in range(5)] == [0, 1, 4, 9, 16]
+    assert square.__name__ == "square"
+    assert len(recorder) == 3
+    assert [r.args for r in recorder.records()] == [(2,), (3,), (4,)]
+    assert recorder.report("{name}({args}) -> {result}") == [
+        "square(2) -> 4",
+        "square(3) -> 9",
+        "square(4) -> 16",
+    ]
+    assert sum(recorder.histogram("square").values()) == 5  # the histogram sees all calls
+
+
+def test_recorder_sampling_and_disabling():
+    recorder = ClockRecorder(keep_args=False)
+    double = recorder.wrap(lambda n: 2 * n, sample_every=10)
+    for n in range(100):
+        assert double(n) == 2 * n
+    assert len(recorder) == 10
+    assert recorder.records()[0].args == ()
+    recorder.enabled = False
+    double(1)
+    assert len(recorder) == 10
+
+
+def test_recorder_sampled_calls_count_for_all_calls():
+    recorder = ClockRecorder()
+
+    def sampled_square(n: int) -> int:
+        return n * n
+
+    clocked = recorder.wrap(sampled_square, sample_every=10)
+    for n in range(100):
+        clocked(n)
+    stats = metrics.snapshot()[qualified_name(sampled_square)]
+    assert len(recorder) == 10
+    assert stats["calls"] == stats["top_level_calls"] == 100
@@ -0,0 +1,270 @@
+# bulk rendering for htmlize from cache_decorator
+# htmlize on a big nested sequence pays, for every element, a singledispatch lookup through
+# the ABC hierarchy, and for every level, a join building a new string
+# HtmlRenderer produces the same html with:
+# - a dict from concrete type to implementation, filled from htmlize.dispatch on first sight
+#   and emptied when implementations are registered
+# - sequences are walked by the renderer itself, writing every piece into one list,
+#   without recursion, so any depth of nesting can be rendered
+# - stream() yields the html in chunks of about chunk_size pieces, so a list of millions
+#   of items is rendered without holding the whole html in memory
+# - overrides replace the implementation of some types, until those types are registered again
+# htmlize caches the html of recent floats and Decimals itself (cache_decorator.approximate),
+# htmlize_number and htmlize_numbers use that cache without the dispatch
+# timings: python -m Part_II_Functions_as_Objects.chapter_9_decorators_and_closures.htmlize_bulk
+import functools
+import timeit
+from abc import get_cache_token
+from array import array
+from collections import abc
+from decimal import Decimal
+from fractions import Fraction
+from typing import Any, Callable, Iterable, Iterator, Optional, Union
+
+import pytest
+
+from .cache_decorator import approximate, htmlize
+
+OPEN, SEP, CLOSE = "<ul>\n<li>", "</li>\n<li>", "</li>\n</ul>"
+
+
+def htmlize_number(x: Union[float, Decimal]) -> str:
+    cls = type(x)
+    if cls is not float and cls is not Decimal:  # subclasses may format themselves differently
+        return htmlize(x)
+    return approximate(cls, f"{x}")
+
+
+def htmlize_numbers(values: Iterable[Union[float, Decimal]]) -> list[str]:
+    # a whole column at once, e.g. an array('d') or a memoryview of doubles
+    typecode = values.typecode if isinstance(values, array) else getattr(values, "format", "")
+    if typecode in ("f", "d"):  # all floats
+        return [approximate(float, f"{x}") for x in values.tolist()]
+    return list(map(htmlize_number, values))
+
+
+class HtmlRenderer:
+    # overrides: implementations for concrete types that take precedence over generic,
+    # as long as generic dispatches those types to the implementation it had when the renderer
+    # was created: a type registered again afterwards is rendered like generic renders it
+
+    def __init__(
+        self,
+        generic: Callable[[Any], str] = htmlize,
+        overrides: Optional[dict[type, Callable[[Any], str]]] = None,
+    ):
+        self.generic = generic
+        self.overrides = overrides or {}
+        self._replaced = {cls: generic.dispatch(cls) for cls in self.overrides}
+        self._dispatch: dict[type, Callable[[Any], str]] = {}
+        self._token = None
+
+    def _check_registry(self) -> None:
+        # registering an implementation, or a virtual subclass of an ABC, changes the dispatch
+        # the registry items are compared, not just counted: registering a type again
+        # replaces its implementation
+        token = (tuple(self.generic.registry.items()), get_cache_token())
+        if token != self._token:
+            self._dispatch.clear()
+            self._dispatch.update(
+                (cls, impl)
+                for cls, impl in self.overrides.items()
+                if self.generic.dispatch(cls) is self._replaced[cls]
+            )
+            self._token = token
+            self._sequence = self.generic.registry.get(abc.Sequence)
+
+    def _impl(self, cls: type) -> Callable[[Any], str]:
+        impl = self._dispatch[cls] = self.generic.dispatch(cls)
+        return impl
+
+    def _walk(self, seq: abc.Sequence, out: list[str], chunk_size: float) -> Iterator[str]:
+        # depth first, with a stack of the iterators of the enclosing sequences instead of
+        # recursive calls: no RecursionError however deep the nesting, and no frame per level
+        # open holds the ids of the sequences being rendered, a sequence containing itself
+        # would otherwise be rendered until memory runs out
+        dispatch, sequence, impl_of = self._dispatch, self._sequence, self._impl
+        append = out.append
+        append(OPEN)
+        stack = []
+        open_ids = [id(seq)]
+        open_set = {id(seq)}
+        items, first = iter(seq), True
+        while True:
+            for item in items:
+                if first:
+                    first = False
+                else:
+                    append(SEP)
+                cls = type(item)
+                impl = dispatch.get(cls) or impl_of(cls)
+                if impl is sequence:
+                    if id(item) in open_set:
+                        raise ValueError(f"cannot render a sequence containing itself: {cls}")
+                    open_ids.append(id(item))
+                    open_set.add(id(item))
+                    stack.append(items)
+                    items, first = iter(item), True
+                    append(OPEN)
+                    break
+                append(impl(item))
+                if len(out) >= chunk_size:
+                    yield "".join(out)
+                    out.clear()
+            else:  # items exhausted
+                append(CLOSE)
+                open_set.discard(open_ids.pop())
+                if not stack:
+                    return
+                items, first = stack.pop(), False
+
+    def render(self, obj: Any) -> str:
+        self._check_registry()
+        cls = type(obj)
+        impl = self._dispatch.get(cls) or self._impl(cls)
+        if impl is not self._sequence:
+            return impl(obj)
+        out: list[str] = []
+        for _ in self._walk(obj, out, float("inf")):  # yields nothing
+            pass
+        return "".join(out)
+
+    def stream(self, obj: Any, chunk_size: int = 4096) -> Iterator[str]:
+        self._check_registry()
+        cls = type(obj)
+        impl = self._dispatch.get(cls) or self._impl(cls)
+        if impl is not self._sequence:
+            yield impl(obj)
+            return
+        out: list[str] = []
+        yield from self._walk(obj, out, chunk_size)
+        if out:
+            yield "".join(out)
+
+
+renderer = HtmlRenderer()
+
+
+def sample(size: int) -> list:
+    row = [1, 2.5, "a < b", True, Fraction(1, 3), Decimal("0.1"), None, (7, "x")]
+    return [[row[i % len(row)] for i in range(j, j + 10)] for j in range(size // 10)]
+
+
+def test_render_matches_htmlize():
+    data = [sample(100), "text\nmore", [], [[[]]], (1, [2, (3,)]), b"ab", 42, {1, 2}]
+    for obj in [data, *data]:
+        assert renderer.render(obj) == htmlize(obj)
+        assert "".join(renderer.stream(obj, chunk_size=7)) == htmlize(obj)
+
+
+def test_stream_yields_bounded_chunks():
+    chunks = list(renderer.stream(sample(10_000), chunk_size=100))
+    assert len(chunks) > 100
+    assert max(map(len, chunks)) < 100 * 40
+
+
+def nested(depth: int, leaf: Any = 1) -> list:
+    tree = [leaf]
+    for level in range(depth):
+        tree = [level, tree, "x"]
+    return tree
+
+
+def test_render_any_depth():
+    shallow = nested(150)
+    assert renderer.render(shallow) == htmlize(shallow)
+    deep = nested(100_000)
+    with pytest.raises(RecursionError):
+        htmlize(deep)
+    html = renderer.render(deep)
+    assert html.count("<ul>") == 100_001
+    assert html == "".join(renderer.stream(deep, chunk_size=50))
+
+
+def test_render_rejects_cycles():
+    cyclic = [1]
+    cyclic.append([2, cyclic])
+    with pytest.raises(ValueError):
+        renderer.render(cyclic)
+    with pytest.raises(ValueError):
+        list(renderer.stream(cyclic))
+    shared = [1]
+    assert renderer.render([shared, shared]) == htmlize([shared, shared])  # not a cycle
+
+
+def test_htmlize_numbers_match_htmlize():
+    values = [0.5, Decimal("0.50"), 0.0, -0.0, Decimal("1E+3"), 1e300, 1 / 3, Decimal("-7.25")]
+    assert htmlize_numbers(values) == [htmlize(x) for x in values]
+    assert htmlize_numbers(values * 3) == [htmlize(x) for x in values] * 3
+    column = array("d", [0.1, 2.5, 0.1, -0.0])
+    assert htmlize_numbers(column) == htmlize_numbers(memoryview(column)) == [
+        htmlize(x) for x in column
+    ]
+    assert htmlize_number(True) == htmlize(True)
+
+
+def test_dispatch_cache_follows_registrations():
+    # a generic function of the test, registrations on htmlize would leak into other tests
+    @functools.singledispatch
+    def generic(obj: object) -> str:
+        return "<pre>object</pre>"
+
+    @generic.register
+    def _(seq: abc.Sequence) -> str:
+        return OPEN + SEP.join(map(generic, seq)) + CLOSE
+
+    class Point(tuple):
+        pass
+
+    local = HtmlRenderer(generic)
+    data = [Point((1, 2)), 3]
+    assert local.render(data) == generic(data)
+
+    @generic.register
+    def _(p: Point) -> str:
+        return "<pre>point</pre>"
+
+    @generic.register
+    def _(n: int) -> str:
+        return "<pre>int</pre>"
+
+    expected = OPEN + "<pre>point</pre>" + SEP + "<pre>int</pre>" + CLOSE
+    assert local.render(data) == generic(data) == expected
+
+    @generic.register
+    def _(n: int) -> str:  # registered again: same registry size, new implementation
+        return f"<pre>{n}</pre>"
+
+    assert local.render(data) == generic(data)
+
+
+def test_overrides_give_way_to_registrations():
+    @functools.singledispatch
+    def generic(obj: object) -> str:
+        return "<pre>object</pre>"
+
+    @generic.register
+    def _(seq: abc.Sequence) -> str:
+        return OPEN + SEP.join(map(generic, seq)) + CLOSE
+
+    local = HtmlRenderer(generic, overrides={float: lambda x: "<pre>fast</pre>"})
+    assert local.render([1.5]) == OPEN + "<pre>fast</pre>" + CLOSE
+
+    @generic.register
+    def _(x: float) -> str:
+        return f"<pre>{x}</pre>"
+
+    assert local.render([1.5]) == generic([1.5]) == OPEN + "<pre>1.5</pre>" + CLOSE
+
+
+def main(size: int = 200_000) -> None:
+    wide, deep = sample(size), [nested(100) for _ in range(size // 300)]
+    prices = [round(i % 1000 * 0.25, 2) for i in range(size)]
+    for data_name, data in [("wide", wide), ("deep", deep), ("prices", prices)]:
+        for name, func in [("htmlize", htmlize), ("render", renderer.render)]:
+            elapsed = min(timeit.repeat(lambda: func(data), number=1, repeat=3))
+            print(f"{data_name:<6} {name:<8} {elapsed:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,29 @@
 import time
 from typing import Callable, Any
 
+import pytest
+
+from .clock_metrics import StepTimer, is_stepped, metrics, qualified_name, timed_steps
+
 
 def clock(func: Callable[..., Any]) -> Callable[..., Any]:
-    def clocked(*args) -> Any:
-        t0 = time.perf_counter()
-        result = func(*args)
-        elapsed = time.perf_counter() - t0
+    key = qualified_name(func)  # every clocked function also reports into the global metrics registry
+
+    def report(timer, args, kwargs, result) -> None:
+        elapsed = timer.elapsed
         name = func.__name__
         arg_str = ", ".join(repr(arg) for arg in args)
         print(f"[{elapsed:.8f}s] {name}({arg_str}) -> {result}")
+
+    # a coroutine function returns as soon as the coroutine is created, a generator function
+    # as soon as the generator is created - timed_steps times them until they complete
+    if is_stepped(func):
+        return timed_steps(func, key, report)
+
+    def clocked(*args) -> Any:
+        with metrics.timer(key) as timer:
+            result = func(*args)
+        report(timer, args, {}, result)
         return result
 
     return clocked
@@ -42,19 +56,59 @@ def test_clock():
 
 # better way to implement decorators is to use functools.wraps decorator
 import functools
-
-
-def better_clock(func: Callable[..., Any]) -> Callable[..., Any]:
-    @functools.wraps(func)
-    def clocked(*args, **kwargs) -> Any:
-        t0 = time.perf_counter()
-        result = func(*args, **kwargs)
-        elapsed = time.perf_counter() - t0
+from typing import Optional
+
+from .clock_recorder import ClockRecorder
+
+
+def better_clock(
+    func: Optional[Callable[..., Any]] = None,
+    *,
+    recorder: Optional[ClockRecorder] = None,
+    sample_every: int = 1,
+    recursive: bool = False,
+) -> Callable[..., Any]:
+    # @better_clock prints every call, @better_clock(recorder=...) records into the recorder instead,
+    # timing 1 in sample_every calls - see clock_recorder.py
+    # @better_clock(recursive=True) prints one line per top-level call of a recursive function,
+    # with inclusive time, exclusive time and the number of calls made by the recursion
+    if func is None:
+        return functools.partial(
+            better_clock, recorder=recorder, sample_every=sample_every, recursive=recursive
+        )
+    if recorder is not None:
+        return recorder.wrap(func, sample_every)
+    key = qualified_name(func)
+
+    def report(timer, args, kwargs, result) -> None:
+        if recursive and not timer.top_level:
+            return
+        elapsed = timer.elapsed
         name = func.__name__
         arg_lst = [repr(arg) for arg in args]
         arg_lst.extend(f"{k}={v!r}" for k, v in kwargs.items())
         arg_str = ", ".join(arg_lst)
-        print(f"[{elapsed:0.8f}s] {name}({arg_str}) -> {result!r}")
+        if isinstance(timer, StepTimer):  # coroutine or generator: wall time, and time running
+            print(
+                f"[{elapsed:0.8f}s, {timer.running:0.8f}s running] "
+                f"{name}({arg_str}) -> {result!r}"
+            )
+        elif recursive:
+            print(
+                f"[{elapsed:0.8f}s inclusive, {timer.exclusive:0.8f}s exclusive, "
+                f"{timer.calls} calls] {name}({arg_str}) -> {result!r}"
+            )
+        else:
+            print(f"[{elapsed:0.8f}s] {name}({arg_str}) -> {result!r}")
+
+    if is_stepped(func):
+        return timed_steps(func, key, report)
+
+    @functools.wraps(func)
+    def clocked(*args, **kwargs) -> Any:
+        with metrics.timer(key) as timer:
+            result = func(*args, **kwargs)
+        report(timer, args, kwargs, result)
         return result
 
     return clocked
@@ -70,3 +124,60 @@ def test_better_clock():
     assert (
         factorial.__name__ == "factorial"
     )  # the name of the decorated function is changed
+
+
+def test_better_clock_recorder(capsys):
+    recorder = ClockRecorder()
+
+    @better_clock(recorder=recorder)
+    def fact(n: int) -> int:
+        return 1 if n < 2 else n * fact(n - 1)
+
+    assert fact(6) == 720
+    assert capsys.readouterr().out == ""
+    assert len(recorder) == 6
+    assert recorder.report("{name}({args}) -> {result}")[-1] == "fact(6) -> 720"
+
+
+def test_clocked_calls_reported_to_metrics():
+    factorial(4)
+    stats = metrics.snapshot()[qualified_name(factorial.__wrapped__)]
+    assert stats["calls"] >= 4
+    # recursive calls are aggregated into the top-level call, so self time equals total time
+    assert stats["self_seconds"] == pytest.approx(stats["total_seconds"])
+
+
+def test_better_clock_recursive(capsys):
+    @better_clock(recursive=True)
+    def fibo(n: int) -> int:
+        return n if n < 2 else fibo(n - 2) + fibo(n - 1)
+
+    assert fibo(6) == 8
+    fibo(1)
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 2  # one line per top-level call, not one per frame
+    assert lines[0].endswith("exclusive, 25 calls] fibo(6) -> 8")
+    assert lines[1].endswith("exclusive, 1 calls] fibo(1) -> 1")
+
+
+def test_better_clock_async_and_generators(capsys):
+    import asyncio
+
+    @better_clock
+    async def fetch(delay: float) -> str:
+        await asyncio.sleep(delay)
+        return "data"
+
+    @better_clock
+    def countdown(n: int):
+        while n:
+            yield n
+            n -= 1
+
+    assert asyncio.run(fetch(0.05)) == "data"
+    assert list(countdown(3)) == [3, 2, 1]
+    first, second = capsys.readouterr().out.splitlines()
+    # timed until the coroutine completes, not only until it is created
+    assert float(first[1 : first.index("s,")]) >= 0.05
+    assert first.endswith("s running] fetch(0.05) -> 'data'")
+    assert second.endswith("s running] countdown(3) -> None")
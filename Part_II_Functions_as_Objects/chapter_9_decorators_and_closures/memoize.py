@@ -0,0 +1,560 @@
+# memoization decorator for expensive functions (e.g. API calls) in multithreaded programs
+# functools.cache is unbounded, functools.lru_cache only bounds the number of entries,
+# and neither can expire results - memoize adds:
+# - eviction policies: "lru" (least recently used), "lfu" (least frequently used),
+#   "ttl" (the entry closest to expiring)
+# - ttl: results older than ttl seconds are computed again, with any policy
+# - maxbytes: a bound on the memory used by cached values,
+#   measured with sizeof (sys.getsizeof by default)
+# - per-key locking: when threads miss on the same key at the same time, only one of them calls
+#   the function, the others wait for its result; misses on different keys don't wait for each other
+# - cache_info() with hits, misses and evictions, like lru_cache
+# - backend: where the results are stored, MemoCache (in memory) by default,
+#   see memoize_backends for SQLite and memory-mapped files that survive restarts
+# - async def functions: the awaited results are cached, not the coroutines,
+#   and concurrent calls with the same key await one shared task
+import asyncio
+import functools
+import hashlib
+import inspect
+import pickle
+import random
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from decimal import Decimal
+from fractions import Fraction
+from typing import Any, Callable, Hashable, Iterator, NamedTuple, Optional, Union
+
+import pytest
+
+POLICIES = ("lru", "lfu", "ttl")
+
+
+class CacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    evictions: int
+    currsize: int
+    maxsize: Optional[int]
+    currbytes: int
+    maxbytes: Optional[int]
+
+
+class _Entry:
+    __slots__ = ("value", "size", "expires", "uses")
+
+    def __init__(self, value: Any, size: int, expires: float):
+        self.value = value
+        self.size = size
+        self.expires = expires
+        self.uses = 0
+
+
+_MISSING = object()
+_KWD_MARK = object()  # separates positional from keyword arguments in keys
+
+
+def make_key(args: tuple, kwargs: dict, typed: bool = False) -> Hashable:
+    key = args
+    if kwargs:
+        key += (_KWD_MARK,) + tuple(kwargs.items())
+    if typed:
+        key += tuple(type(arg) for arg in args)
+        key += tuple(type(value) for value in kwargs.values())
+    return key
+
+
+# persistent backends need keys that are the same in every process, hash() of str isn't
+# stable_key hashes a canonical encoding of the arguments instead,
+# where sets and dicts are sorted so that their iteration order doesn't matter
+# keys are always typed: f(1) and f(1.0) are different keys
+_SCALARS = (bool, int, float, complex, str, bytes, Decimal, Fraction)
+
+
+def _canonical(obj: Any) -> str:
+    cls = type(obj)
+    if obj is None or cls in _SCALARS:
+        return f"{cls.__name__}:{obj!r}"
+    if cls in (tuple, list):
+        return f"{cls.__name__}({','.join(map(_canonical, obj))})"
+    if cls in (set, frozenset):
+        return f"{cls.__name__}({','.join(sorted(map(_canonical, obj)))})"
+    if cls is dict:
+        items = sorted(f"{_canonical(k)}:{_canonical(v)}" for k, v in obj.items())
+        return f"dict({','.join(items)})"
+    return f"pickle:{pickle.dumps(obj, protocol=4).hex()}"
+
+
+def stable_key(func: Callable[..., Any], args: tuple, kwargs: dict, version: str = "") -> str:
+    name = f"{func.__module__}.{func.__qualname__}"
+    text = f"{name}|{version}|{_canonical(args)}|{_canonical(kwargs)}"
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def source_version(func: Callable[..., Any]) -> str:
+    # changes when the source of func is edited, so stored results of the old code are not used
+    try:
+        code = inspect.getsource(func).encode()
+    except (OSError, TypeError):  # no source file, e.g. defined in the REPL
+        if not hasattr(func, "__code__"):
+            return ""  # builtins
+        code = func.__code__.co_code + repr(func.__code__.co_consts).encode()
+    return hashlib.sha256(code).hexdigest()[:16]
+
+
+class KeyLocking:
+    # per-key locks for the keys being computed, shared by all the backends
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight: dict[Hashable, list] = {}  # key -> [lock, number of threads using it]
+
+    @contextmanager
+    def key_lock(self, key: Hashable) -> Iterator[None]:
+        # held while the value of key is computed
+        with self._lock:
+            inflight = self._inflight.setdefault(key, [threading.Lock(), 0])
+            inflight[1] += 1
+        try:
+            with inflight[0]:
+                yield
+        finally:
+            with self._lock:
+                inflight[1] -= 1
+                if not inflight[1]:
+                    del self._inflight[key]
+
+
+class MemoCache(KeyLocking):
+    # thread-safe in-memory store of the memoize decorator
+    # every policy finds its victim in O(1):
+    # - "lru": entries are kept in an OrderedDict in order of last use, the victim is the first
+    # - "ttl": every entry lives ttl seconds, so the order of insertion is the order of expiry,
+    #   gets don't move the entries and the victim is the first
+    # - "lfu": the keys are also kept in buckets by number of uses, each in order of last use,
+    #   the victim is the first key of the bucket with the fewest uses
+
+    def __init__(
+        self,
+        maxsize: Optional[int] = 128,
+        maxbytes: Optional[int] = None,
+        ttl: Optional[float] = None,
+        policy: str = "lru",
+        sizeof: Callable[[Any], int] = sys.getsizeof,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        if policy not in POLICIES:
+            raise ValueError(f"policy must be one of {POLICIES}, not {policy!r}")
+        if policy == "ttl" and ttl is None:
+            raise ValueError("the 'ttl' policy needs a ttl")
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.ttl = ttl
+        self.policy = policy
+        self.sizeof = sizeof
+        self.clock = clock
+        self._entries: OrderedDict[Hashable, _Entry] = OrderedDict()
+        self._buckets: dict[int, OrderedDict[Hashable, None]] = {}  # "lfu": uses -> keys
+        self._min_uses = 0
+        self._bytes = 0
+        self._hits = self._misses = self._evictions = 0
+        super().__init__()
+
+    def get(self, key: Hashable) -> Any:
+        # the cached value, or _MISSING
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires <= self.clock():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                return _MISSING
+            self._hits += 1
+            if self.policy == "lfu":
+                self._unlink(key, entry.uses)
+                self._buckets.setdefault(entry.uses + 1, OrderedDict())[key] = None
+            elif self.policy == "lru":
+                self._entries.move_to_end(key)
+            entry.uses += 1
+            return entry.value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        # called after every miss with the computed value
+        size = self.sizeof(value) if self.maxbytes is not None else 0
+        expires = self.clock() + self.ttl if self.ttl is not None else float("inf")
+        with self._lock:
+            self._misses += 1
+            if self.maxsize == 0 or self.maxbytes is not None and size > self.maxbytes:
+                return  # would evict everything and still not fit
+            if key in self._entries:
+                self._remove(key)
+            # make room before inserting: a new entry has no uses yet, so "lfu"
+            # would always pick it as the victim
+            while self._entries and self._over_limit(size):
+                self._remove(self._victim())
+                self._evictions += 1
+            self._entries[key] = _Entry(value, size, expires)
+            self._bytes += size
+            if self.policy == "lfu":
+                self._buckets.setdefault(0, OrderedDict())[key] = None
+                self._min_uses = 0
+
+    def count_hit(self) -> None:
+        # a result computed for another caller, e.g. a call that joined an async task
+        with self._lock:
+            self._hits += 1
+
+    def _over_limit(self, size: int) -> bool:
+        # would adding an entry of size bytes exceed the limits
+        return (self.maxsize is not None and len(self._entries) >= self.maxsize) or (
+            self.maxbytes is not None and self._bytes + size > self.maxbytes
+        )
+
+    def _victim(self) -> Hashable:
+        if self.policy == "lfu":  # least used, the least recently used among those
+            if self._min_uses not in self._buckets:
+                # the bucket was emptied by an expiry or a replacement, not by a get
+                self._min_uses = min(self._buckets)
+            return next(iter(self._buckets[self._min_uses]))
+        return next(iter(self._entries))
+
+    def _unlink(self, key: Hashable, uses: int) -> None:
+        # take key out of its "lfu" bucket
+        bucket = self._buckets[uses]
+        del bucket[key]
+        if not bucket:
+            del self._buckets[uses]
+            if uses == self._min_uses:
+                self._min_uses += 1  # where a get moves the key
+
+    def _remove(self, key: Hashable) -> None:
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+        if self.policy == "lfu":
+            self._unlink(key, entry.uses)
+
+    def cache_info(self) -> CacheInfo:
+        with self._lock:
+            return CacheInfo(
+                self._hits,
+                self._misses,
+                self._evictions,
+                len(self._entries),
+                self.maxsize,
+                self._bytes,
+                self.maxbytes,
+            )
+
+    def cache_clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+            self._bytes = 0
+            self._hits = self._misses = self._evictions = 0
+
+
+def memoize(
+    func: Optional[Callable[..., Any]] = None,
+    *,
+    maxsize: Optional[int] = 128,
+    maxbytes: Optional[int] = None,
+    ttl: Optional[float] = None,
+    policy: str = "lru",
+    typed: bool = False,
+    sizeof: Callable[[Any], int] = sys.getsizeof,
+    backend: Optional[KeyLocking] = None,
+    version: Union[bool, str] = False,
+) -> Callable[..., Any]:
+    # use as @memoize or @memoize(maxsize=1000, ttl=60, policy="lfu", ...)
+    # maxsize, maxbytes, ttl, policy and sizeof configure the default MemoCache,
+    # a backend is configured when it is created
+    # version=True keys the results by the source of func, a string sets the version explicitly
+    if func is None:
+        return functools.partial(
+            memoize,
+            maxsize=maxsize,
+            maxbytes=maxbytes,
+            ttl=ttl,
+            policy=policy,
+            typed=typed,
+            sizeof=sizeof,
+            backend=backend,
+            version=version,
+        )
+    cache = backend if backend is not None else MemoCache(maxsize, maxbytes, ttl, policy, sizeof)
+    hashed_keys = getattr(cache, "hashed_keys", False)
+    if version is True:
+        version = source_version(func)
+
+    def key_of(args: tuple, kwargs: dict) -> Hashable:
+        if hashed_keys:
+            return stable_key(func, args, kwargs, version or "")
+        return make_key(args, kwargs, typed)
+
+    if inspect.iscoroutinefunction(func):
+        memoized = _memoize_async(func, cache, key_of)
+        memoized.cache = cache
+        memoized.cache_info = cache.cache_info
+        memoized.cache_clear = cache.cache_clear
+        return memoized
+
+    @functools.wraps(func)
+    def memoized(*args, **kwargs) -> Any:
+        key = key_of(args, kwargs)
+        value = cache.get(key)
+        if value is not _MISSING:
+            return value
+        with cache.key_lock(key):
+            value = cache.get(key)  # computed by another thread while this one waited
+            if value is _MISSING:
+                value = func(*args, **kwargs)
+                cache.set(key, value)
+        return value
+
+    memoized.cache = cache
+    memoized.cache_info = cache.cache_info
+    memoized.cache_clear = cache.cache_clear
+    return memoized
+
+
+def _memoize_async(func: Callable[..., Any], cache: KeyLocking, key_of) -> Callable[..., Any]:
+    # single-flight for coroutines: the first caller missing on a key starts a task,
+    # the callers arriving while it runs await the same task
+    # every caller awaits it through asyncio.shield, so cancelling one caller doesn't cancel
+    # the task for the others; when all of them are cancelled the task is cancelled too
+    # exceptions reach every caller and are not cached
+    # callers that get the result of a task started by another caller count as hits,
+    # like threads that wait for another thread in the synchronous wrapper
+    # the shared tasks belong to the event loop of the first caller: use one loop at a time
+    inflight: dict[Hashable, list] = {}  # key -> [task, number of callers awaiting it]
+
+    def landed(key: Hashable, flight: list, task: asyncio.Future) -> None:
+        if inflight.get(key) is flight:
+            del inflight[key]
+        if not task.cancelled() and task.exception() is None:
+            cache.set(key, task.result())
+
+    @functools.wraps(func)
+    async def memoized(*args, **kwargs) -> Any:
+        key = key_of(args, kwargs)
+        value = cache.get(key)
+        if value is not _MISSING:
+            return value
+        flight = inflight.get(key)
+        joined = flight is not None
+        if not joined:
+            task = asyncio.ensure_future(func(*args, **kwargs))
+            flight = inflight[key] = [task, 0]
+            task.add_done_callback(functools.partial(landed, key, flight))
+        task = flight[0]
+        flight[1] += 1
+        try:
+            value = await asyncio.shield(task)
+            if joined:
+                cache.count_hit()
+            return value
+        finally:
+            flight[1] -= 1
+            if not flight[1] and not task.done():  # nobody is waiting for it anymore
+                if inflight.get(key) is flight:
+                    del inflight[key]  # callers arriving from now on start a new task
+                task.cancel()
+
+    memoized.inflight = inflight
+    return memoized
+
+
+def test_memoize_lru_and_stats():
+    calls = []
+
+    @memoize(maxsize=2)
+    def square(n):
+        calls.append(n)
+        return n * n
+
+    assert [square(1), square(2), square(1), square(3), square(2)] == [1, 4, 1, 9, 4]
+    assert calls == [1, 2, 3, 2]  # 2 was the least recently used when 3 came
+    assert square.cache_info()[:4] == (1, 4, 2, 2)
+
+
+def test_memoize_lfu():
+    @memoize(maxsize=2, policy="lfu")
+    def identity(n):
+        return n
+
+    identity(1), identity(1), identity(2), identity(3)
+    assert identity.cache.get(make_key((1,), {})) == 1  # used most, survives
+    assert identity.cache.get(make_key((2,), {})) is _MISSING
+
+
+def test_memoize_lfu_admits_new_keys():
+    calls = []
+
+    @memoize(maxsize=2, policy="lfu")
+    def identity(n):
+        calls.append(n)
+        return n
+
+    for n in [1, 1, 2, 2, 3, 3, 3, 3, 3]:
+        identity(n)
+    assert calls == [1, 2, 3]  # 3 was cached although 1 and 2 had been hit
+    assert identity.cache_info().evictions == 1
+
+
+def test_memo_cache_lfu_matches_scan():
+    # the buckets pick the entry a scan of all the entries would pick: fewest uses, then
+    # least recently used, with entries also leaving through expiry and replacement
+    rnd = random.Random(3)
+    now = [0.0]
+    cache = MemoCache(maxsize=5, ttl=30, policy="lfu", clock=lambda: now[0])
+    model: dict[int, list] = {}  # key -> [uses, last use, expires]
+    for step in range(5000):
+        now[0] = step
+        key = rnd.randrange(12)
+        if key in model and model[key][2] <= step:
+            del model[key]
+        if rnd.random() < 0.6:
+            if key in model:
+                model[key][:2] = model[key][0] + 1, step
+            assert (cache.get(key) is _MISSING) == (key not in model)
+        else:
+            model.pop(key, None)
+            if len(model) == 5:
+                del model[min(model, key=lambda k: model[k][:2])]
+            model[key] = [0, step, step + 30]
+            cache.set(key, key)
+        assert cache.cache_info().currsize == len(model)
+
+
+def test_memo_cache_ttl():
+    now = [0.0]
+    cache = MemoCache(ttl=10, policy="ttl", clock=lambda: now[0])
+    cache.set("a", 1)
+    now[0] = 5
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    now[0] = 12
+    assert cache.get("a") is _MISSING  # expired
+    assert cache.get("b") == 2
+    full = MemoCache(maxsize=2, ttl=10, policy="ttl", clock=lambda: now[0])
+    full.set("a", 1), full.set("b", 2), full.get("a"), full.set("c", 3)
+    assert full.get("a") is _MISSING  # expires first, although it was used last
+
+
+def test_memoize_maxbytes():
+    @memoize(maxsize=None, maxbytes=1000, sizeof=len)
+    def blob(n):
+        return b"x" * n
+
+    blob(400), blob(400.0), blob(500), blob(300), blob(5000)
+    info = blob.cache_info()
+    assert info.currbytes == 800 and info.currsize == 2 and info.evictions == 1
+    assert (info.hits, info.misses) == (1, 4)  # 5000 bytes are too big to cache
+
+
+def test_memoize_single_flight():
+    calls = []
+    barrier = threading.Barrier(8)
+
+    @memoize
+    def slow(n):
+        calls.append(n)
+        time.sleep(0.05)
+        return n
+
+    def worker():
+        barrier.wait()
+        assert slow(42) == 42
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert calls == [42]
+    assert slow.cache_info().hits == 7
+
+
+def test_memoize_invalid_policy():
+    with pytest.raises(ValueError):
+        memoize(policy="mru")(abs)
+
+
+def test_stable_key_ignores_iteration_order():
+    words = ["spam", "eggs", "ham", "bacon"]
+    a = stable_key(abs, ({"x": 1, "y": [2]}, set(words)), {"n": 1.5})
+    b = stable_key(abs, ({"y": [2], "x": 1}, set(reversed(words))), {"n": 1.5})
+    assert a == b
+    assert stable_key(abs, (1,), {}) != stable_key(abs, (1.0,), {})
+    assert stable_key(abs, (1,), {}) != stable_key(abs, (1,), {}, version="2")
+
+
+def test_memoize_async_coalesces_concurrent_calls():
+    calls = []
+
+    @memoize(ttl=60)
+    async def fetch(n):
+        calls.append(n)
+        await asyncio.sleep(0.01)
+        return n * 10
+
+    async def main():
+        results = await asyncio.gather(*(fetch(n % 2) for n in range(20)))
+        assert results == [n % 2 * 10 for n in range(20)]
+        assert await fetch(1) == 10
+        assert not fetch.inflight
+
+    asyncio.run(main())
+    assert sorted(calls) == [0, 1]
+    assert fetch.cache_info()[:2] == (19, 2)  # 18 calls joined the 2 tasks, then 1 cached hit
+
+
+def test_memoize_async_cancellation():
+    started = []
+
+    @memoize
+    async def slow(n):
+        started.append(n)
+        await asyncio.sleep(0.05)
+        return n
+
+    async def main():
+        first = asyncio.ensure_future(slow(1))
+        second = asyncio.ensure_future(slow(1))
+        await asyncio.sleep(0)
+        first.cancel()  # second still gets the result
+        assert await second == 1
+        assert first.cancelled()
+        alone = asyncio.ensure_future(slow(2))
+        await asyncio.sleep(0)
+        task = slow.inflight[(2,)][0]
+        alone.cancel()  # the only caller: the call itself is cancelled
+        with pytest.raises(asyncio.CancelledError):
+            await alone
+        await asyncio.sleep(0)
+        assert task.cancelled() and not slow.inflight
+
+    asyncio.run(main())
+    assert started == [1, 2]
+
+
+def test_memoize_async_does_not_cache_errors():
+    attempts = []
+
+    @memoize
+    async def flaky(n):
+        attempts.append(n)
+        if len(attempts) == 1:
+            raise ConnectionError("upstream down")
+        return n
+
+    async def main():
+        with pytest.raises(ConnectionError):
+            await flaky(3)
+        assert await flaky(3) == 3
+
+    asyncio.run(main())
+    assert attempts == [3, 3]
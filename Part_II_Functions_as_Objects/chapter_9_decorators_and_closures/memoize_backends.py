@@ -0,0 +1,367 @@
+# storage backends for memoize that keep the results on disk
+# results in MemoCache are lost on every restart, these survive it and are shared
+# by all the processes on the host that open the same file:
+# - SQLiteCache: a table in a SQLite database, WAL mode lets processes read while one writes
+# - MmapCache: an append-only file of checksummed records, read through mmap
+# values are pickled, keys are stable_key hashes of the arguments (see memoize)
+# a result is computed once per process at most, not once per host:
+# two processes missing on the same key at the same time both call the function
+import mmap
+import os
+import pickle
+import sqlite3
+import struct
+import threading
+import time
+import zlib
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Optional, Tuple
+
+try:
+    import fcntl  # serializes appends from several processes, not available on Windows
+except ImportError:
+    fcntl = None
+
+from .memoize import _MISSING, CacheInfo, KeyLocking, memoize
+
+Record = Tuple[float, bytes]  # expiry time, pickled value
+
+
+class PersistentCache(KeyLocking, ABC):
+    # expiry times are wall clock time, which every process agrees on
+    hashed_keys = True
+
+    def __init__(self, ttl: Optional[float] = None, clock: Callable[[], float] = time.time):
+        super().__init__()
+        self.ttl = ttl
+        self.clock = clock
+        self._hits = self._misses = self._evictions = 0
+
+    def get(self, key: str) -> Any:
+        record = self._load(key)
+        if record is None or record[0] <= self.clock():
+            return _MISSING
+        with self._lock:
+            self._hits += 1
+        return pickle.loads(record[1])
+
+    def set(self, key: str, value: Any) -> None:
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        expires = self.clock() + self.ttl if self.ttl is not None else float("inf")
+        evicted = self._store(key, expires, data)
+        with self._lock:
+            self._misses += 1
+            self._evictions += evicted
+
+    def count_hit(self) -> None:
+        with self._lock:
+            self._hits += 1
+
+    def cache_info(self) -> CacheInfo:
+        size, nbytes = self._stats()
+        maxsize = getattr(self, "maxsize", None)
+        return CacheInfo(self._hits, self._misses, self._evictions, size, maxsize, nbytes, None)
+
+    def cache_clear(self) -> None:
+        self._clear()
+        with self._lock:
+            self._hits = self._misses = self._evictions = 0
+
+    @abstractmethod
+    def _load(self, key: str) -> Optional[Record]:
+        """Return the stored record of key, or None."""
+
+    @abstractmethod
+    def _store(self, key: str, expires: float, data: bytes) -> int:
+        """Store a record and return the number of evicted entries."""
+
+    @abstractmethod
+    def _stats(self) -> Tuple[int, int]:
+        """Return the number of entries and the bytes of stored values."""
+
+    @abstractmethod
+    def _clear(self) -> None:
+        """Remove all the entries."""
+
+
+class SQLiteCache(PersistentCache):
+    # maxsize drops the entries stored first
+
+    def __init__(self, path: str, maxsize: Optional[int] = None, ttl: Optional[float] = None):
+        super().__init__(ttl)
+        self.path = path
+        self.maxsize = maxsize
+        self._local = threading.local()  # a sqlite3 connection can't be shared by threads
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS memo (key TEXT PRIMARY KEY, expires REAL, value BLOB)"
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _load(self, key: str) -> Optional[Record]:
+        return self._connection().execute(
+            "SELECT expires, value FROM memo WHERE key = ?", (key,)
+        ).fetchone()
+
+    def _store(self, key: str, expires: float, data: bytes) -> int:
+        conn = self._connection()
+        # isolation_level=None is autocommit, the insert and the eviction need an explicit
+        # transaction, committed by the with block (or rolled back on an exception)
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            # REPLACE deletes the old row, so the rowid always grows with the time of storage
+            conn.execute("INSERT OR REPLACE INTO memo VALUES (?, ?, ?)", (key, expires, data))
+            if self.maxsize is None:
+                return 0
+            return conn.execute(
+                "DELETE FROM memo WHERE rowid IN "
+                "(SELECT rowid FROM memo ORDER BY rowid DESC LIMIT -1 OFFSET ?)",
+                (self.maxsize,),
+            ).rowcount
+
+    def _stats(self) -> Tuple[int, int]:
+        size, nbytes = self._connection().execute(
+            "SELECT COUNT(*), TOTAL(LENGTH(value)) FROM memo"
+        ).fetchone()
+        return size, int(nbytes)
+
+    def _clear(self) -> None:
+        self._connection().execute("DELETE FROM memo")
+
+    def close(self) -> None:
+        # closes the connection of the calling thread
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+# MmapCache file format: records of header, key (utf-8) and value, one after the other
+# a key stored again is appended again, the last record wins
+# a record with an empty key marks a cache_clear(): the records before it are dropped
+# every record starts with _MAGIC and a crc32 of the rest of it, so a record left incomplete
+# by a process that died while writing it is detected and skipped, with the records after it
+_HEADER = struct.Struct("<4sIIId")  # magic, crc32, key length, value length, expiry time
+_MAGIC = b"MEMO"
+_CHECKED = 8  # the crc covers the record from this offset (key length) to its end
+
+
+def _record(key: bytes, expires: float, data: bytes) -> bytes:
+    body = _HEADER.pack(_MAGIC, 0, len(key), len(data), expires)[_CHECKED:] + key + data
+    return _MAGIC + struct.pack("<I", zlib.crc32(body)) + body
+
+
+class MmapCache(PersistentCache):
+    # the index of record positions is kept in memory and updated with the records
+    # appended by other processes before every lookup
+    # the file only grows, even cache_clear() appends: other processes have it mapped,
+    # and reading a mapped page past the end of a truncated file raises SIGBUS
+    # compact() rewrites it without the stale and expired records, and must only be called
+    # when no other process is using the file; the file must not be truncated by other means
+
+    def __init__(self, path: str, ttl: Optional[float] = None):
+        super().__init__(ttl)
+        self.path = path
+        self._io = threading.Lock()
+        self._open()
+
+    def _open(self) -> None:
+        self._file = open(self.path, "a+b")
+        self._map: Optional[mmap.mmap] = None
+        self._index: dict[str, Tuple[int, int, float]] = {}  # key -> value offset, length, expiry
+        self._end = 0  # bytes of the file already indexed
+
+    def _refresh(self) -> None:
+        if self._scan(resync=False):
+            return
+        # a record that doesn't check out is either being written by another process,
+        # or was left incomplete; appends hold an exclusive lock, so under a shared lock
+        # it is the latter, and the scan goes on from the next record
+        if fcntl is not None:
+            fcntl.flock(self._file, fcntl.LOCK_SH)
+        try:
+            self._scan(resync=True)
+        finally:
+            if fcntl is not None:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+
+    def _scan(self, resync: bool) -> bool:
+        # indexes the records appended since the last scan,
+        # False when it stops on an invalid record (without resync)
+        size = os.fstat(self._file.fileno()).st_size
+        if size == self._end:
+            return True
+        if self._map is not None:
+            self._map.close()
+        self._map = mmap.mmap(self._file.fileno(), size, access=mmap.ACCESS_READ)
+        buf, pos = self._map, self._end
+        while pos < size:
+            key = None
+            if pos + _HEADER.size <= size:
+                magic, crc, key_len, value_len, expires = _HEADER.unpack_from(buf, pos)
+                start = pos + _HEADER.size + key_len
+                end = start + value_len
+                checked = magic == _MAGIC and end <= size
+                if checked and zlib.crc32(buf[pos + _CHECKED : end]) == crc:
+                    try:
+                        key = buf[pos + _HEADER.size : start].decode()
+                    except UnicodeDecodeError:
+                        pass  # not written by MmapCache
+            if key is None:
+                if not resync:
+                    self._end = pos
+                    return False
+                found = buf.find(_MAGIC, pos + 1)
+                pos = found if found >= 0 else size
+                continue
+            if key:
+                self._index[key] = (start, value_len, expires)
+            else:
+                self._index.clear()
+            pos = end
+        self._end = pos
+        return True
+
+    def _load(self, key: str) -> Optional[Record]:
+        with self._io:
+            self._refresh()  # one fstat when no other process wrote to the file
+            entry = self._index.get(key)
+            if entry is None:
+                return None
+            start, length, expires = entry
+            return expires, self._map[start : start + length]
+
+    def _append(self, record: bytes) -> None:
+        if fcntl is not None:
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        try:
+            self._file.write(record)
+            self._file.flush()
+        finally:
+            if fcntl is not None:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+
+    def _store(self, key: str, expires: float, data: bytes) -> int:
+        encoded = key.encode()
+        if not encoded:
+            raise ValueError("the empty key is reserved")
+        with self._io:
+            self._append(_record(encoded, expires, data))
+            self._refresh()
+        return 0
+
+    def _stats(self) -> Tuple[int, int]:
+        now = self.clock()
+        with self._io:
+            self._refresh()
+            live = [length for _, length, expires in self._index.values() if expires > now]
+        return len(live), sum(live)
+
+    def _clear(self) -> None:
+        with self._io:
+            self._append(_record(b"", 0.0, b""))
+            self._refresh()
+
+    def compact(self) -> None:
+        now = self.clock()
+        with self._io:
+            self._refresh()
+            records = [
+                _record(key.encode(), expires, self._map[start : start + length])
+                for key, (start, length, expires) in self._index.items()
+                if expires > now
+            ]
+            with open(self.path + ".tmp", "wb") as tmp:
+                tmp.writelines(records)
+            self._close()
+            os.replace(self.path + ".tmp", self.path)
+            self._open()
+            self._refresh()
+
+    def _close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+        self._file.close()
+
+    def close(self) -> None:
+        with self._io:
+            self._close()
+
+
+def test_sqlite_cache_survives_restart(tmp_path):
+    path = str(tmp_path / "memo.sqlite")
+    calls = []
+
+    def fetch(user_id, fields=("name",)):
+        calls.append(user_id)
+        return {"id": user_id, "fields": list(fields)}
+
+    first = memoize(backend=SQLiteCache(path))(fetch)
+    assert first(1) == first(1) == {"id": 1, "fields": ["name"]}
+    restarted = memoize(backend=SQLiteCache(path))(fetch)  # a new process opening the same file
+    assert restarted(1) == {"id": 1, "fields": ["name"]}
+    assert calls == [1]
+    assert restarted.cache_info()[:4] == (1, 0, 0, 1)
+
+
+def test_sqlite_cache_maxsize_and_ttl(tmp_path):
+    now = [0.0]
+    cache = SQLiteCache(str(tmp_path / "memo.sqlite"), maxsize=2, ttl=10)
+    cache.clock = lambda: now[0]
+    for key in "abc":
+        cache.set(key, key.upper())
+    assert cache.get("a") is _MISSING and cache.get("c") == "C"
+    now[0] = 11
+    assert cache.get("c") is _MISSING
+    assert cache.cache_info().evictions == 1
+
+
+def test_mmap_cache_shared_between_instances(tmp_path):
+    path = str(tmp_path / "memo.bin")
+    writer, reader = MmapCache(path), MmapCache(path)
+    assert reader.get("k") is _MISSING
+    writer.set("k", [1, 2, 3])
+    writer.set("k", "newer")
+    assert reader.get("k") == "newer"  # appended after reader mapped the file
+    writer.cache_clear()
+    assert reader.get("k") is _MISSING  # the clear marker was appended under reader
+    reader.close()
+    writer.set("k", "x" * 1000)
+    writer.set("k", "short")
+    writer.set("other", 42)
+    writer.compact()
+    assert os.path.getsize(path) < 100
+    assert MmapCache(path).cache_info().currsize == 2
+    writer.close()
+
+
+def test_mmap_cache_skips_incomplete_records(tmp_path):
+    path = str(tmp_path / "memo.bin")
+    cache = MmapCache(path)
+    cache.set("a", "A")
+    record = _record(b"b", float("inf"), pickle.dumps("B"))
+    foreign = _record(b"\xff", float("inf"), b"")  # a key that isn't utf-8
+    with open(path, "ab") as f:
+        f.write(record[:-3] + foreign)  # as left by a process killed while appending
+    assert cache.get("b") is _MISSING
+    cache.set("c", "C")
+    assert cache.get("c") == "C" and cache.get("a") == "A"
+    reopened = MmapCache(path)
+    assert (reopened.get("a"), reopened.get("b"), reopened.get("c")) == ("A", _MISSING, "C")
+    cache.close()
+    reopened.close()
+
+
+def test_version_invalidates_results(tmp_path):
+    backend = MmapCache(str(tmp_path / "memo.bin"))
+    v1 = memoize(backend=backend, version="1")(lambda n: ("v1", n))
+    v2 = memoize(backend=backend, version="2")(lambda n: ("v2", n))
+    assert v1(1) == ("v1", 1) and v2(1) == ("v2", 1)
+    assert memoize(backend=backend, version=True)(abs)(-2) == 2  # builtins have no source
+    backend.close()
@@ -1,5 +1,7 @@
 import time
 
+from .clock_metrics import is_stepped, metrics, qualified_name, timed_steps
+
 # for simplicity, the clock decorator will be simpler than the one in 'implementing_simple_decorator.py'
 
 DEFAULT_FMT = "[{elapsed:0.8f}s] {name}({args}) -> {result}"
@@ -7,16 +9,24 @@ DEFAULT_FMT = "[{elapsed:0.8f}s] {name}({args}) -> {result}"
 
 def clock(fmt=DEFAULT_FMT):
     def decorate(func):
-        def clocked(*_args):
-            t0 = time.time()
-            _result = func(*_args)
-            elapsed = time.time() - t0
+        key = qualified_name(func)
+
+        def report(timer, _args, _kwargs, _result):
+            elapsed = timer.elapsed
             name = func.__name__
             args = ", ".join(repr(arg) for arg in _args)
             result = repr(_result)
             print(
                 fmt.format(**locals())
-            )  # fmt uses the local variables of clocked (linters will complain about this)
+            )  # fmt uses the local variables of report (linters will complain about this)
+
+        if is_stepped(func):  # coroutines and generators are timed until they complete
+            return timed_steps(func, key, report)
+
+        def clocked(*_args):
+            with metrics.timer(key) as timer:
+                _result = func(*_args)
+            report(timer, _args, {}, _result)
             return _result
 
         return clocked
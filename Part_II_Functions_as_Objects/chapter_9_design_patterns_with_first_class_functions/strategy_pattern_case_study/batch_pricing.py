@@ -0,0 +1,336 @@
+# columnar batch pricing for the functional strategy pattern
+# Order.total() and best_promo() price one order at a time, and every promo calls order.total() again,
+# so a single best_promo() walks the cart up to four times, creating new Decimal objects on every pass.
+# BatchPricer stores a whole list of orders as columns of fixed-point integers (array('q')),
+# and evaluates the promotions as passes over those columns, for all orders at once.
+# Results are the Decimals the per-order path returns, down to their exponent (4.5, not 4.500):
+# - integer arithmetic on fixed-point values is exact, and so is Decimal arithmetic as long as
+#   no coefficient needs more digits than the context precision (28 by default);
+#   orders whose values could need more are priced with Decimal arithmetic, which rounds them
+# - the exponent of every result is computed the way Decimal arithmetic computes it, from the
+#   decimal places of the prices of the order and of the promotion rates
+# A column with a value that doesn't fit in 64 bits (many decimal places, huge quantities)
+# is kept as a list of Python ints instead: slower, but still exact.
+
+from array import array
+from collections.abc import Iterable
+from decimal import Decimal, getcontext
+from itertools import accumulate
+from operator import mul, sub
+from typing import Callable, List, Union
+
+from .functional_strategy_pattern import (
+    BULK_QUANTITY,
+    BULK_RATE,
+    FIDELITY_POINTS,
+    FIDELITY_RATE,
+    LARGE_ORDER_ITEMS,
+    LARGE_ORDER_RATE,
+    Order,
+    bulk_item_promo,
+    fidelity_promo,
+    large_order_promo,
+    promo_index,
+)
+
+
+def _percent(rate: Decimal) -> int:
+    percent = rate * 100
+    if percent != int(percent):
+        raise ValueError(f"batch pricing needs whole percent rates, not {rate}")
+    return int(percent)
+
+
+# rates of the promotions in percent, so that they can be applied to integers
+FIDELITY_PERCENT = _percent(FIDELITY_RATE)
+BULK_PERCENT = _percent(BULK_RATE)
+LARGE_ORDER_PERCENT = _percent(LARGE_ORDER_RATE)
+# exponents of the rates: a discount of total * rate has the exponent of total plus this
+FIDELITY_EXPONENT = FIDELITY_RATE.as_tuple().exponent
+BULK_EXPONENT = BULK_RATE.as_tuple().exponent
+LARGE_ORDER_EXPONENT = LARGE_ORDER_RATE.as_tuple().exponent
+# a coefficient of a discount is at most 10 ** -RATE_EXPONENT times the one of the total
+RATE_EXPONENT = min(0, FIDELITY_EXPONENT, BULK_EXPONENT, LARGE_ORDER_EXPONENT)
+
+BATCH_PROMOS = (fidelity_promo, bulk_item_promo, large_order_promo)
+
+Column = Union[array, List[int]]
+
+
+def _column(values: Iterable[int]) -> Column:
+    values = list(values)
+    try:
+        return array("q", values)
+    except OverflowError:
+        return values
+
+
+def _exponent(price: Decimal) -> int:
+    exponent = price.as_tuple().exponent
+    if not isinstance(exponent, int):
+        raise ValueError(f"cannot price non-finite value: {price!r}")
+    return exponent
+
+
+def _decimal(value: int, scale: int, exponent: int) -> Decimal:
+    # value / 10 ** scale, written with the given exponent (value must be a multiple of it)
+    shift = scale + exponent
+    coefficient = value // 10**shift if shift >= 0 else value * 10**-shift
+    return Decimal(coefficient).scaleb(exponent)
+
+
+def _best_of_batch_promos(order: Order) -> Decimal:
+    # best_promo() restricted to the promotions BatchPricer evaluates
+    candidates = [promo for promo in promo_index.candidates(order) if promo in BATCH_PROMOS]
+    return max((promo(order) for promo in candidates), default=Decimal(0))
+
+
+class BatchPricer:
+    # prices are stored as integers scaled by 10 ** scale, where scale is the largest number of
+    # decimal places among all prices in the batch
+    # per-line columns: products (interned ids), quantities, prices, line_totals
+    # per-order columns: fidelity, offsets - lines of order i are offsets[i]:offsets[i + 1]
+    # discounts are kept as integers scaled by 10 ** (scale + 2), because promo rates are percentages
+    # every result column has a column of the exponents its Decimals are written with
+
+    def __init__(self, orders: Iterable[Order]):
+        self.orders = list(orders)
+        exponents = [_exponent(item.price) for order in self.orders for item in order.cart]
+        self.scale = max(0, -min(exponents, default=0))
+        self.fidelity = _column(order.customer.fidelity for order in self.orders)
+        offsets, products, quantities, prices = [0], [], [], []
+        # the lowest exponent of the prices of each order, of all the lines and of the bulk lines
+        order_exponents, bulk_exponents = [], []
+        product_ids: dict[str, int] = {}
+        line_exponents = iter(exponents)
+        for order in self.orders:
+            lowest, lowest_bulk = 0, None
+            for item in order.cart:
+                exponent = next(line_exponents)
+                products.append(product_ids.setdefault(item.product, len(product_ids)))
+                quantities.append(item.quantity)
+                prices.append(int(item.price.scaleb(self.scale)))
+                lowest = min(lowest, exponent)
+                if item.quantity >= BULK_QUANTITY:
+                    lowest_bulk = exponent if lowest_bulk is None else min(lowest_bulk, exponent)
+            offsets.append(len(quantities))
+            order_exponents.append(lowest)
+            bulk_exponents.append(lowest_bulk)
+        self.offsets = _column(offsets)
+        self.products = _column(products)
+        self.quantities = _column(quantities)
+        self.prices = _column(prices)
+
+        self.line_totals = _column(map(mul, self.quantities, self.prices))
+        self._totals = self._sum_per_order(self.line_totals)
+        fidelity_ok = [points >= FIDELITY_POINTS for points in self.fidelity]
+        large_order_ok = [
+            len(set(self.products[start:stop])) >= LARGE_ORDER_ITEMS
+            for start, stop in zip(self.offsets, self.offsets[1:])
+        ]
+        self._fidelity = _column(
+            total * FIDELITY_PERCENT if ok else 0 for total, ok in zip(self._totals, fidelity_ok)
+        )
+        # True where quantity >= BULK_QUANTITY, multiplying by a bool masks out the other lines
+        bulk_lines = map(mul, self.line_totals, map(BULK_QUANTITY.__le__, self.quantities))
+        self._bulk_item = _column(
+            total * BULK_PERCENT for total in self._sum_per_order(_column(bulk_lines))
+        )
+        self._large_order = _column(
+            total * LARGE_ORDER_PERCENT if ok else 0
+            for total, ok in zip(self._totals, large_order_ok)
+        )
+
+        # Decimal arithmetic: a sum has the lowest exponent of its terms, Decimal(0) included,
+        # a product the sum of the exponents of its factors (a quantity has exponent 0),
+        # and a promo that doesn't apply returns Decimal(0)
+        self._totals_exponents = _column(order_exponents)
+        self._fidelity_exponents = _column(
+            exponent + FIDELITY_EXPONENT if ok else 0
+            for exponent, ok in zip(order_exponents, fidelity_ok)
+        )
+        self._bulk_item_exponents = _column(
+            min(0, exponent + BULK_EXPONENT) if exponent is not None else 0
+            for exponent in bulk_exponents
+        )
+        self._large_order_exponents = _column(
+            exponent + LARGE_ORDER_EXPONENT if ok else 0
+            for exponent, ok in zip(order_exponents, large_order_ok)
+        )
+        # best_promo() is the first of the largest discounts of the promos that apply
+        best, best_exponents = [], []
+        promo_columns = [
+            (fidelity_ok, self._fidelity, self._fidelity_exponents),
+            ([exponent is not None for exponent in bulk_exponents], self._bulk_item,
+             self._bulk_item_exponents),
+            (large_order_ok, self._large_order, self._large_order_exponents),
+        ]
+        for i in range(len(self.orders)):
+            value, exponent, found = 0, 0, False
+            for ok, column, exponents in promo_columns:
+                if ok[i] and (not found or column[i] > value):
+                    value, exponent, found = column[i], exponents[i], True
+            best.append(value)
+            best_exponents.append(exponent)
+        self._best = _column(best)
+        self._best_exponents = _column(best_exponents)
+
+        # every coefficient Decimal arithmetic computes for an order (line totals, partial sums,
+        # discounts, due) is at most twice the sum of its absolute line totals, written with the
+        # exponent of its total, times 10 ** -RATE_EXPONENT
+        limit = 10 ** getcontext().prec
+        magnitudes = self._sum_per_order(_column(map(abs, self.line_totals)))
+        self._decimal_orders = {
+            i
+            for i, (magnitude, exponent) in enumerate(zip(magnitudes, order_exponents))
+            if 2 * (magnitude // 10 ** (self.scale + exponent)) * 10**-RATE_EXPONENT >= limit
+        }
+
+    def __len__(self):
+        return len(self.orders)
+
+    def _sum_per_order(self, line_values: Column) -> Column:
+        # prefix sums make the total of any order a single subtraction
+        running = _column(accumulate(line_values, initial=0))
+        ends = (running[i] for i in self.offsets[1:])
+        starts = (running[i] for i in self.offsets[:-1])
+        return _column(map(sub, ends, starts))
+
+    def _to_decimals(
+        self,
+        column: Column,
+        scale: int,
+        exponents: Column,
+        priced: Callable[[Order], Decimal],
+    ) -> List[Decimal]:
+        # priced is the per-order computation, for the orders that need Decimal arithmetic
+        decimal_orders = self._decimal_orders
+        return [
+            priced(self.orders[i]) if i in decimal_orders else _decimal(value, scale, exponent)
+            for i, (value, exponent) in enumerate(zip(column, exponents))
+        ]
+
+    def totals(self) -> List[Decimal]:
+        return self._to_decimals(self._totals, self.scale, self._totals_exponents, Order.total)
+
+    def fidelity_promo(self) -> List[Decimal]:
+        return self._to_decimals(
+            self._fidelity, self.scale + 2, self._fidelity_exponents, fidelity_promo
+        )
+
+    def bulk_item_promo(self) -> List[Decimal]:
+        return self._to_decimals(
+            self._bulk_item, self.scale + 2, self._bulk_item_exponents, bulk_item_promo
+        )
+
+    def large_order_promo(self) -> List[Decimal]:
+        return self._to_decimals(
+            self._large_order, self.scale + 2, self._large_order_exponents, large_order_promo
+        )
+
+    def best_promo(self) -> List[Decimal]:
+        # only the three promotions above are evaluated in batch,
+        # promos registered later have to be priced with the per-order best_promo()
+        return self._to_decimals(
+            self._best, self.scale + 2, self._best_exponents, _best_of_batch_promos
+        )
+
+    def due(self) -> List[Decimal]:
+        # equivalent of [order.due() for order in orders];
+        # orders with a promotion that has no columnar equivalent fall back to calling it
+        columns = {
+            fidelity_promo: (self._fidelity, self._fidelity_exponents),
+            bulk_item_promo: (self._bulk_item, self._bulk_item_exponents),
+            large_order_promo: (self._large_order, self._large_order_exponents),
+        }
+        scale = self.scale + 2
+        result = []
+        for i, order in enumerate(self.orders):
+            total, exponent = self._totals[i] * 100, self._totals_exponents[i]
+            if i in self._decimal_orders:
+                due = order.due()
+            elif order.promotion is None:
+                due = _decimal(total, scale, exponent)
+            elif order.promotion in columns:
+                discounts, exponents = columns[order.promotion]
+                due = _decimal(total - discounts[i], scale, min(exponent, exponents[i]))
+            else:
+                due = _decimal(total, scale, exponent) - order.promotion(order)
+            result.append(due)
+        return result
+
+
+def exactly(decimals: List[Decimal]) -> List[tuple]:
+    # == on Decimals ignores the exponent: Decimal("4.5") == Decimal("4.500")
+    return [d.as_tuple() for d in decimals]
+
+
+def sample_orders() -> List[Order]:
+    from .functional_strategy_pattern import Customer, LineItem
+
+    joe = Customer("John Doe", 0)
+    ann = Customer("Ann Smith", 1100)
+    cart = [
+        LineItem("banana", 4, Decimal(".5")),
+        LineItem("apple", 10, Decimal("1.5")),
+        LineItem("watermelon", 5, Decimal(5)),
+    ]
+    banana_cart = [LineItem("banana", 30, Decimal(".5")), LineItem("apple", 10, Decimal("1.5"))]
+    long_cart = [LineItem(str(code), 1, Decimal("1.00")) for code in range(10)]
+    free_cart = [LineItem(str(code), 1, Decimal("0.0")) for code in range(10)]
+    return [
+        Order(joe, cart, fidelity_promo),
+        Order(ann, cart, fidelity_promo),
+        Order(joe, banana_cart, bulk_item_promo),
+        Order(joe, long_cart, large_order_promo),
+        Order(ann, long_cart),
+        Order(ann, [LineItem("gold", 1000, Decimal("123456.123456789012345"))], fidelity_promo),
+        Order(ann, [LineItem("tea", 3, Decimal("1.5"))], bulk_item_promo),
+        Order(joe, free_cart, large_order_promo),
+        Order(joe, [], large_order_promo),
+        Order(ann, [LineItem("x", 25, Decimal("2E+1"))], lambda order: Decimal("0.125")),
+    ]
+
+
+def test_batch_matches_per_order_path():
+    from .functional_strategy_pattern import best_promo
+
+    orders = sample_orders()
+    pricer = BatchPricer(orders)
+    assert exactly(pricer.totals()) == exactly(order.total() for order in orders)
+    assert exactly(pricer.best_promo()) == exactly(best_promo(order) for order in orders)
+    assert exactly(pricer.due()) == exactly(order.due() for order in orders)
+    for promo in BATCH_PROMOS:
+        assert exactly(getattr(pricer, promo.__name__)()) == exactly(map(promo, orders))
+
+
+def test_batch_keeps_the_exponents_of_each_order():
+    from .functional_strategy_pattern import Customer, LineItem
+
+    ann = Customer("Ann Smith", 1100)
+    orders = [
+        Order(ann, [LineItem("tea", 3, Decimal("1.5"))]),
+        Order(ann, [LineItem("gold", 1, Decimal("1.000000001"))], fidelity_promo),
+    ]
+    assert str(BatchPricer(orders).totals()[0]) == "4.5"  # not 4.500000000
+    assert str(BatchPricer(orders).due()[0]) == "4.5"
+
+
+def test_batch_rounds_like_decimal_beyond_context_precision():
+    from .functional_strategy_pattern import Customer, LineItem, best_promo
+
+    ann = Customer("Ann Smith", 1100)
+    many_places = LineItem("g", 7, Decimal("1.0000000000000000000000000013"))
+    orders = [Order(ann, [many_places], fidelity_promo), *sample_orders()]
+    pricer = BatchPricer(orders)
+    assert str(pricer.due()[0]) == str(orders[0].due()) == "6.650000000000000000000000009"
+    assert exactly(pricer.due()) == exactly(order.due() for order in orders)
+    assert exactly(pricer.best_promo()) == exactly(best_promo(order) for order in orders)
+    assert exactly(pricer.totals()) == exactly(order.total() for order in orders)
+
+
+if __name__ == "__main__":
+    # run as a module: python -m <package>.batch_pricing
+    pricer = BatchPricer(sample_orders())
+    print(pricer.best_promo())
+    print(pricer.due())
@@ -0,0 +1,118 @@
+# compact cart for the functional strategy pattern
+# a cart of LineItem named tuples costs a tuple, a str and a Decimal per line - a few hundred bytes.
+# CompactCart stores the same lines in parallel array columns:
+# an interned product id, the quantity and the price in fixed-point units (cents for scale=2),
+# which is about 20 bytes per line.
+# It is a Sequence[LineItem], LineItems are created only when a line is read,
+# so it can be used as Order.cart without changes to Order or to the promotions.
+
+import sys
+from array import array
+from collections.abc import Iterable, Iterator, Sequence
+from decimal import Decimal
+from typing import List, Union, overload
+
+from .functional_strategy_pattern import LineItem
+
+
+class CompactCart(Sequence):
+    def __init__(self, items: Iterable[LineItem] = (), scale: int = 2):
+        self.scale = scale
+        self._names: List[str] = []  # product id -> product
+        self._ids: dict[str, int] = {}  # product -> product id
+        self._products = array("I")
+        self._quantities = array("q")
+        self._prices = array("q")
+        self.extend(items)
+
+    def _product_id(self, product: str) -> int:
+        try:
+            return self._ids[product]
+        except KeyError:
+            product = sys.intern(product)
+            self._ids[product] = len(self._names)
+            self._names.append(product)
+            return self._ids[product]
+
+    def append(self, item: LineItem) -> None:
+        units = item.price.scaleb(self.scale)
+        if units != units.to_integral_value():
+            raise ValueError(
+                f"price {item.price} has more than {self.scale} decimal places"
+            )
+        self._products.append(self._product_id(item.product))
+        self._quantities.append(item.quantity)
+        self._prices.append(int(units))
+
+    def extend(self, items: Iterable[LineItem]) -> None:
+        for item in items:
+            self.append(item)
+
+    def __len__(self):
+        return len(self._quantities)
+
+    def _line(self, product_id: int, quantity: int, units: int) -> LineItem:
+        return LineItem(self._names[product_id], quantity, Decimal(units).scaleb(-self.scale))
+
+    @overload
+    def __getitem__(self, index: int) -> LineItem: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> "CompactCart": ...
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[LineItem, "CompactCart"]:
+        if isinstance(index, slice):
+            # the slice shares the product table, which only grows
+            cart = CompactCart(scale=self.scale)
+            cart._names, cart._ids = self._names, self._ids
+            cart._products = self._products[index]
+            cart._quantities = self._quantities[index]
+            cart._prices = self._prices[index]
+            return cart
+        return self._line(self._products[index], self._quantities[index], self._prices[index])
+
+    def __iter__(self) -> Iterator[LineItem]:
+        for columns in zip(self._products, self._quantities, self._prices):
+            yield self._line(*columns)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({list(self)!r}, scale={self.scale})"
+
+    def nbytes(self) -> int:
+        # size of the per-line columns, the product table is shared by all lines
+        columns = (self._products, self._quantities, self._prices)
+        return sum(column.itemsize * len(column) for column in columns)
+
+
+if __name__ == "__main__":
+    # run as a module: python -m <package>.compact_cart
+    import tracemalloc
+
+    from .functional_strategy_pattern import (
+        Customer,
+        Order,
+        best_promo,
+        bulk_item_promo,
+    )
+
+    def lines(count: int) -> Iterator[LineItem]:
+        for i in range(count):
+            yield LineItem(f"sku{i % 1000}", i % 30 + 1, Decimal(i % 5000 + 1) / 100)
+
+    for cart_class in (list, CompactCart):
+        tracemalloc.start()
+        cart = cart_class(lines(200_000))
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"{cart_class.__name__}: {size / len(cart):.1f} bytes per line")
+
+    lines_list = list(lines(5_000))
+    compact = CompactCart(lines_list)
+    assert list(compact) == lines_list
+    assert compact[-1] == lines_list[-1]
+    assert list(compact[10:20]) == lines_list[10:20]
+    customer = Customer("Ann Smith", 1100)
+    assert Order(customer, compact, bulk_item_promo).due() == Order(
+        customer, lines_list, bulk_item_promo
+    ).due()
+    assert best_promo(Order(customer, compact)) == best_promo(Order(customer, lines_list))
@@ -1,6 +1,10 @@
-from collections.abc import Sequence
+from bisect import bisect_right
+from collections.abc import Iterator, Sequence
+from contextlib import contextmanager
+from contextvars import ContextVar
 from decimal import Decimal
-from typing import Optional, Callable, NamedTuple, List
+import functools
+from typing import Optional, Callable, Dict, NamedTuple, List, Tuple, Union
 
 class Customer(NamedTuple):
     name: str
@@ -22,51 +26,271 @@ class Order(NamedTuple):  # the Context
     promotion: Optional[Callable[["Order"], Decimal]] = None
 
     def total(self) -> Decimal:
+        # not cached: Order is an immutable tuple without room for a cache,
+        # and the cart is often a list that can change after the total is computed
         totals = (item.total() for item in self.cart)
         return sum(totals, start=Decimal(0))
 
     def due(self) -> Decimal:
-        if self.promotion is None:
-            discount = Decimal(0)
-        else:
-            discount = self.promotion(self)
-        return self.total() - discount
+        with pricing(self) as context:
+            if self.promotion is None:
+                discount = Decimal(0)
+            else:
+                discount = self.promotion(self)
+            return context.total() - discount
+
+
+class OrderContext:
+    # evaluation context of a single order, built with one pass over the cart
+    # promotions read the cached total, line totals and distinct products from it,
+    # so pricing an order costs O(len(cart)) instead of O(len(cart) * len(promos))
+    # promotions are still called with the order, and get its context with order_context(order):
+    # while Order.due() or best_promo() runs, that is the one context built for the call
+
+    __slots__ = (
+        "order",
+        "customer",
+        "cart",
+        "line_totals",
+        "distinct_products",
+        "max_quantity",
+        "_total",
+    )
+
+    def __init__(self, order: Order):
+        self.order = order
+        self.customer = order.customer
+        self.cart = order.cart
+        self.line_totals = [item.total() for item in order.cart]
+        self.distinct_products = {item.product for item in order.cart}
+        self.max_quantity = max((item.quantity for item in order.cart), default=0)
+        self._total = sum(self.line_totals, start=Decimal(0))
+
+    def total(self) -> Decimal:
+        return self._total
+
+
+# the contexts of the orders being priced, by id of the order; a ContextVar keeps the orders
+# priced by different threads or asyncio tasks apart
+_contexts: ContextVar[Dict[int, OrderContext]] = ContextVar("order_contexts")
+
+
+@contextmanager
+def pricing(order: Order) -> Iterator[OrderContext]:
+    # order_context(order) returns the same context until the block exits
+    contexts = _contexts.get({})
+    context = contexts.get(id(order))
+    if context is not None and context.order is order:  # already being priced
+        yield context
+        return
+    context = OrderContext(order)
+    token = _contexts.set({**contexts, id(order): context})
+    try:
+        yield context
+    finally:
+        _contexts.reset(token)
+
+
+def order_context(order: Union[Order, OrderContext]) -> OrderContext:
+    if isinstance(order, OrderContext):
+        return order
+    context = _contexts.get({}).get(id(order))
+    if context is not None and context.order is order:
+        return context
+    return OrderContext(order)
 
 
 Promotion = Callable[[Order], Decimal]
 
-promos: List[Promotion] = []
 
+class Eligibility(NamedTuple):
+    # thresholds an order has to reach before a promotion can give any discount
+    # 0 means no threshold on that field: any value, negative ones included, is accepted
+    min_fidelity: int = 0
+    min_quantity: int = 0  # of at least one LineItem
+    min_distinct_items: int = 0
+
+    def accepts(self, values: Tuple[int, int, int]) -> bool:
+        return all(value >= threshold for value, threshold in zip(values, self) if threshold)
+
+
+def eligibility_values(context: OrderContext) -> Tuple[int, int, int]:
+    return (
+        context.customer.fidelity,
+        context.max_quantity,
+        len(context.distinct_products),
+    )
+
+
+class PromoList(list):
+    # the list of promos, counting its changes so that promo_index can follow them,
+    # whether promos are registered with @promotion or appended, removed or replaced directly
+    changes = 0
+
+
+def _counting(method):
+    @functools.wraps(method)
+    def counted(self, *args):
+        self.changes += 1
+        return method(self, *args)
+
+    return counted
 
-def promotion(promo: Promotion) -> Promotion:
-    promos.append(promo)
-    return promo
 
+for _name in (
+    "append", "extend", "insert", "remove", "pop", "clear", "sort", "reverse",
+    "__setitem__", "__delitem__", "__iadd__", "__imul__",
+):
+    setattr(PromoList, _name, _counting(getattr(list, _name)))
 
-@promotion
+
+class PromoIndex:
+    # indexes the promos of a PromoList by their Eligibility thresholds
+    # for every Eligibility field, the promos with a threshold on that field are sorted by it:
+    # for a given order, bisect finds the promos whose threshold is reached, and only those are
+    # checked against their other thresholds, so promos that cannot apply are never looked at
+    # promos without thresholds (including those appended without @promotion) apply to any order
+    # the index is rebuilt on the first lookup after the list changed
+
+    def __init__(self, promos: PromoList, eligibility: Dict[Promotion, Eligibility]):
+        self.promos = promos
+        self.eligibility = eligibility
+        self._changes = -1
+
+    def __len__(self):
+        return len(self.promos)
+
+    def _build(self) -> None:
+        changes = self.promos.changes
+        promos = list(self.promos)
+        eligibilities = [self.eligibility.get(promo, Eligibility()) for promo in promos]
+        entries: List[List[Tuple[int, int]]] = [[] for _ in Eligibility._fields]
+        unconstrained = []
+        for position, eligibility in enumerate(eligibilities):
+            if not any(eligibility):
+                unconstrained.append(position)
+            for field, threshold in enumerate(eligibility):
+                if threshold:
+                    entries[field].append((threshold, position))
+        fields = []
+        for field_entries in entries:
+            field_entries.sort()
+            fields.append(
+                ([threshold for threshold, _ in field_entries], [pos for _, pos in field_entries])
+            )
+        self._index = promos, eligibilities, fields, unconstrained
+        self._changes = changes
+
+    def candidates(self, order: Union[Order, OrderContext]) -> List[Promotion]:
+        # the promos that can apply to order, in the order of the list
+        if self._changes != self.promos.changes:
+            self._build()
+        promos, eligibilities, fields, unconstrained = self._index
+        values = eligibility_values(order_context(order))
+        found = set(unconstrained)
+        for (thresholds, positions), value in zip(fields, values):
+            found.update(positions[: bisect_right(thresholds, value)])
+        return [
+            promos[position]
+            for position in sorted(found)
+            if eligibilities[position].accepts(values)
+        ]
+
+
+promos = PromoList()
+eligibility: Dict[Promotion, Eligibility] = {}
+promo_index = PromoIndex(promos, eligibility)
+
+
+def promotion(promo: Optional[Promotion] = None, /, **thresholds: int):
+    # use as @promotion, or with the Eligibility thresholds of the promo: @promotion(min_fidelity=1000)
+    # promos appended to promos directly are called for every order
+    def register(promo: Promotion) -> Promotion:
+        eligibility[promo] = Eligibility(**thresholds)
+        promos.append(promo)
+        return promo
+
+    return register if promo is None else register(promo)
+
+
+# thresholds and rates of the promotions below, also used by batch_pricing
+FIDELITY_POINTS, FIDELITY_RATE = 1000, Decimal("0.05")
+BULK_QUANTITY, BULK_RATE = 20, Decimal("0.1")
+LARGE_ORDER_ITEMS, LARGE_ORDER_RATE = 10, Decimal("0.07")
+
+
+@promotion(min_fidelity=FIDELITY_POINTS)
 def fidelity_promo(order: Order) -> Decimal:
     """5% discount for customers with 1000 or more fidelity points"""
-    if order.customer.fidelity >= 1000:
-        return order.total() * Decimal("0.05")
+    if order.customer.fidelity >= FIDELITY_POINTS:
+        return order_context(order).total() * FIDELITY_RATE
     return Decimal(0)
 
-@promotion
+@promotion(min_quantity=BULK_QUANTITY)
 def bulk_item_promo(order: Order) -> Decimal:
     """10% discount for each LineItem with 20 or more units"""
+    context = order_context(order)
     discount = Decimal(0)
-    for item in order.cart:
-        if item.quantity >= 20:
-            discount += item.total() * Decimal("0.1")
+    for item, line_total in zip(context.cart, context.line_totals):
+        if item.quantity >= BULK_QUANTITY:
+            discount += line_total * BULK_RATE
     return discount
 
-@promotion
+@promotion(min_distinct_items=LARGE_ORDER_ITEMS)
 def large_order_promo(order: Order) -> Decimal:
     """7% discount for orders with 10 or more distinct items"""
-    distinct_items = {item.product for item in order.cart}
-    if len(distinct_items) >= 10:
-        return order.total() * Decimal("0.07")
+    context = order_context(order)
+    if len(context.distinct_products) >= LARGE_ORDER_ITEMS:
+        return context.total() * LARGE_ORDER_RATE
     return Decimal(0)
 
 def best_promo(order: Order) -> Decimal:
     """Compute the best discount available"""
-    return max(promo(order) for promo in promos)
\ No newline at end of file
+    with pricing(order) as context:
+        candidates = promo_index.candidates(context)
+        return max((promo(order) for promo in candidates), default=Decimal(0))
+
+def test_promo_index_skips_promos_that_cannot_apply():
+    calls = []
+    saved = list(promos)
+    for points in range(2000, 5000):
+        promotion(min_fidelity=points)(
+            lambda order, points=points: calls.append(points) or Decimal(points)
+        )
+    try:
+        joe = Customer("John Doe", 0)
+        ann = Customer("Ann Smith", 2500)
+        cart = [LineItem("banana", 4, Decimal(".5"))]
+        assert best_promo(Order(joe, cart)) == 0 and calls == []
+        assert best_promo(Order(ann, cart)) == 2500 and calls == list(range(2000, 2501))
+    finally:
+        promos[:] = saved
+
+
+def test_promos_appended_directly_are_used():
+    saved = list(promos)
+    promos.append(lambda order: Decimal(42))  # the way promos were added before @promotion
+    try:
+        assert best_promo(Order(Customer("John Doe", 0), [])) == 42
+        promos.pop()
+        assert best_promo(Order(Customer("John Doe", 0), [])) == 0
+    finally:
+        promos[:] = saved
+
+
+def test_promotions_are_called_with_the_order():
+    def promo(order: Order) -> Decimal:
+        customer, cart, promotion = order  # an Order, not a stand-in for one
+        assert isinstance(order, Order) and cart[0].product == "tea"
+        assert order_context(order) is order_context(order)  # the one built for the call
+        return order_context(order).total() / 2
+
+    order = Order(Customer("Ann Smith", 1100), [LineItem("tea", 3, Decimal("1.5"))], promo)
+    assert order.due() == Decimal("2.25")
+    assert order_context(order) is not order_context(order)  # outside of a call
+    saved = list(promos)
+    promos.append(promo)
+    try:
+        assert best_promo(order) == Decimal("2.25")  # fidelity_promo gives less
+    finally:
+        promos[:] = saved
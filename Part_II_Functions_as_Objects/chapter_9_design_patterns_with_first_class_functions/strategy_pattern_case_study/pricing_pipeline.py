@@ -0,0 +1,100 @@
+# parallel pricing of large order feeds
+# price_orders() takes any iterable of orders (a generator reading a feed works too),
+# cuts it into chunks and prices the chunks in a process pool (or a thread pool).
+# Only a bounded number of chunks is in flight at a time, so memory does not grow with the feed,
+# and results are yielded in input order - the output is the same as map(price, orders).
+
+import os
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from decimal import Decimal
+from itertools import islice
+from typing import List, Optional, Type
+
+from .functional_strategy_pattern import Order
+
+Pricing = Callable[[Order], Decimal]
+
+
+def chunked(orders: Iterable[Order], size: int) -> Iterator[List[Order]]:
+    iterator = iter(orders)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def price_chunk(price: Pricing, chunk: List[Order]) -> List[Decimal]:
+    return [price(order) for order in chunk]
+
+
+def price_orders(
+    orders: Iterable[Order],
+    price: Pricing = Order.due,
+    *,
+    chunk_size: int = 1000,
+    max_workers: Optional[int] = None,
+    executor_class: Type[Executor] = ProcessPoolExecutor,
+    prefetch: int = 2,
+) -> Iterator[Decimal]:
+    # price can be Order.due, best_promo or any other function of one order,
+    # with a ProcessPoolExecutor it has to be picklable, so lambdas only work with a ThreadPoolExecutor
+    # at most max_workers * prefetch chunks are submitted ahead of the one being yielded
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be at least 1")
+    workers = max_workers or os.cpu_count() or 1
+    chunks = chunked(orders, chunk_size)
+    with executor_class(max_workers=workers) as executor:
+        pending: deque[Future] = deque(
+            executor.submit(price_chunk, price, chunk)
+            for chunk in islice(chunks, workers * prefetch)
+        )
+        try:
+            while pending:
+                results = pending.popleft().result()
+                for chunk in islice(chunks, 1):
+                    pending.append(executor.submit(price_chunk, price, chunk))
+                yield from results
+        finally:
+            # when the consumer stops early, don't price chunks nobody will read
+            for future in pending:
+                future.cancel()
+
+
+if __name__ == "__main__":
+    # run as a module: python -m <package>.pricing_pipeline
+    import random
+    from concurrent.futures import ThreadPoolExecutor
+
+    from .functional_strategy_pattern import (
+        Customer,
+        LineItem,
+        best_promo,
+        bulk_item_promo,
+        fidelity_promo,
+        large_order_promo,
+    )
+
+    def order_feed(count: int, seed: int = 42) -> Iterator[Order]:
+        rnd = random.Random(seed)
+        promotions = [None, fidelity_promo, bulk_item_promo, large_order_promo]
+        for _ in range(count):
+            cart = [
+                LineItem(
+                    f"sku{rnd.randrange(20)}",
+                    rnd.randrange(1, 40),
+                    Decimal(rnd.randrange(1, 5000)) / 100,
+                )
+                for _ in range(rnd.randrange(1, 15))
+            ]
+            customer = Customer("customer", rnd.randrange(2000))
+            yield Order(customer, cart, rnd.choice(promotions))
+
+    serial = list(map(Order.due, order_feed(10_000)))
+    assert list(price_orders(order_feed(10_000), chunk_size=500)) == serial
+    assert list(
+        price_orders(order_feed(10_000), chunk_size=500, executor_class=ThreadPoolExecutor)
+    ) == serial
+    assert list(price_orders(order_feed(1_000), best_promo, max_workers=2)) == list(
+        map(best_promo, order_feed(1_000))
+    )
+    print(sum(serial))
@@ -1,7 +1,9 @@
 from abc import ABC, abstractmethod
-from collections.abc import Sequence
+from collections.abc import Iterator, Sequence
+from contextlib import contextmanager
+from contextvars import ContextVar
 from decimal import Decimal
-from typing import NamedTuple, Optional
+from typing import Dict, NamedTuple, Optional, Union
 
 
 class Customer(NamedTuple):
@@ -24,18 +26,73 @@ class Order(NamedTuple):
     promotion: Optional["Promotion"] = None
 
     def total(self) -> Decimal:
+        # not cached: Order is an immutable tuple without room for a cache,
+        # and the cart is often a list that can change after the total is computed
         totals = (item.total() for item in self.cart)
         return sum(totals, Decimal(0))
 
     def due(self) -> Decimal:
-        if self.promotion is None:
-            discount = Decimal(0)
-        else:
-            discount = self.promotion.discount(self)
-        return self.total() - discount
+        with pricing(self) as context:
+            if self.promotion is None:
+                discount = Decimal(0)
+            else:
+                discount = self.promotion.discount(self)
+            return context.total() - discount
 
     def __str__(self) -> str:
-        return f"Order total: {self.total():.2f} due: {self.due():.2f}"
+        with pricing(self) as context:  # one pass over the cart for both numbers
+            return f"Order total: {context.total():.2f} due: {self.due():.2f}"
+
+
+class OrderContext:
+    # evaluation context of a single order, built with one pass over the cart
+    # promotions read the cached total, line totals and distinct products from it,
+    # instead of scanning the cart again for every strategy
+    # Promotion.discount() is still called with the order, and gets its context with
+    # order_context(order): while Order.due() runs, that is the one context built for the call
+
+    __slots__ = ("order", "customer", "cart", "line_totals", "distinct_products", "_total")
+
+    def __init__(self, order: Order):
+        self.order = order
+        self.customer = order.customer
+        self.cart = order.cart
+        self.line_totals = [item.total() for item in order.cart]
+        self.distinct_products = {item.product for item in order.cart}
+        self._total = sum(self.line_totals, Decimal(0))
+
+    def total(self) -> Decimal:
+        return self._total
+
+
+# the contexts of the orders being priced, by id of the order; a ContextVar keeps the orders
+# priced by different threads or asyncio tasks apart
+_contexts: ContextVar[Dict[int, OrderContext]] = ContextVar("order_contexts")
+
+
+@contextmanager
+def pricing(order: Order) -> Iterator[OrderContext]:
+    # order_context(order) returns the same context until the block exits
+    contexts = _contexts.get({})
+    context = contexts.get(id(order))
+    if context is not None and context.order is order:  # already being priced
+        yield context
+        return
+    context = OrderContext(order)
+    token = _contexts.set({**contexts, id(order): context})
+    try:
+        yield context
+    finally:
+        _contexts.reset(token)
+
+
+def order_context(order: Union[Order, OrderContext]) -> OrderContext:
+    if isinstance(order, OrderContext):
+        return order
+    context = _contexts.get({}).get(id(order))
+    if context is not None and context.order is order:
+        return context
+    return OrderContext(order)
 
 
 class Promotion(ABC):  # the Strategy: an abstract base class
@@ -49,7 +106,7 @@ class FidelityPromo(Promotion):  # first Concrete Strategy
 
     def discount(self, order: Order) -> Decimal:
         return (
-            order.total() * Decimal("0.05")
+            order_context(order).total() * Decimal("0.05")
             if order.customer.fidelity >= 1000
             else Decimal(0)
         )
@@ -59,10 +116,11 @@ class BulkItemPromo(Promotion):  # second Concrete Strategy
     """10% discount for each LineItem with 20 or more units."""
 
     def discount(self, order: Order) -> Decimal:
+        context = order_context(order)
         discount = Decimal(0)
-        for item in order.cart:
+        for item, line_total in zip(context.cart, context.line_totals):
             if item.quantity >= 20:
-                discount += item.total() * Decimal("0.1")
+                discount += line_total * Decimal("0.1")
         return discount
 
 
@@ -70,7 +128,9 @@ class LargeOrderPromo(Promotion):  # third Concrete Strategy
     """7% discount for orders with 10 or more distinct items."""
 
     def discount(self, order: Order) -> Decimal:
-        distinct_items = {item.product for item in order.cart}
+        context = order_context(order)
         return (
-            order.total() * Decimal("0.07") if len(distinct_items) >= 10 else Decimal(0)
+            context.total() * Decimal("0.07")
+            if len(context.distinct_products) >= 10
+            else Decimal(0)
         )
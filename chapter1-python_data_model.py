@@ -1,6 +1,11 @@
 import collections
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from operator import add, mul
 from random import choice
 import math
+import random
 
 # Chapter 1: Python Data Model
 # Summary
@@ -28,16 +33,19 @@ suit_values = dict(spades=3, hearts=2, diamonds=1, clubs=0)
 
 
 def spades_high(c: Card):
-    rank_value = FrenchDeck.ranks.index(c.rank)
+    rank_value = FrenchDeck.rank_values[c.rank]  # dict lookup instead of a linear ranks.index()
     return rank_value * len(suit_values) + suit_values[c.suit]
 
 
 class FrenchDeck:
     ranks = [str(n) for n in range(2, 11)] + list('JQKA')
     suits = ["spades", "diamonds", "clubs", "hearts"]
+    # lookup tables built once, when the class is created
+    rank_values = {rank: value for value, rank in enumerate(ranks)}
 
     def __init__(self):
         self._cards = [Card(rank, suit) for suit in self.suits for rank in self.ranks]
+        self._positions = {card: position for position, card in enumerate(self._cards)}
 
     def __len__(self):
         return len(self._cards)
@@ -45,9 +53,108 @@ class FrenchDeck:
     def __getitem__(self, position):
         return self._cards[position]
 
+    # without __contains__, the 'in' operator falls back to a sequential scan using __getitem__
+    def __contains__(self, card):
+        try:
+            return card in self._positions
+        except TypeError:  # unhashable, so it can't be a Card
+            return False
+
+    def position(self, card: Card) -> int:
+        return self._positions[card]
+
+
+# spades_high() of every card computed up front, so a sort key is a single dict lookup:
+# sorted(cards, key=spades_high_key)
+spades_high_keys = {card: spades_high(card) for card in FrenchDeck()}
+spades_high_key = spades_high_keys.__getitem__
+
+
+class Shoe:
+    # several decks shuffled together, as used by casino dealers
+    # every card is stored as a 6-bit code, rank index << 2 | suit index, in one array('B') -
+    # one byte per card instead of a Card tuple; codes are decoded to Card only when needed
+    # pass a seed (or a random.Random instance) to make the shuffles reproducible
+    codes = {
+        card: FrenchDeck.rank_values[card.rank] << 2 | FrenchDeck.suits.index(card.suit)
+        for card in FrenchDeck()
+    }
+    cards = [card for card, _ in sorted(codes.items(), key=lambda item: item[1])]  # code -> Card
+
+    def __init__(self, decks: int = 6, seed: int | random.Random | None = None):
+        self.rng = seed if isinstance(seed, random.Random) else random.Random(seed)
+        self._codes = array('B', map(self.codes.__getitem__, FrenchDeck())) * decks
+        self._next = 0  # position of the next card to deal
+
+    def __len__(self):
+        return len(self._codes) - self._next  # cards left to deal
+
+    @classmethod
+    def decode(cls, codes) -> list[Card]:
+        return list(map(cls.cards.__getitem__, codes))
+
+    def shuffle(self):
+        # gathers the cards back and runs Fisher-Yates over the whole shoe, in place
+        self.rng.shuffle(self._codes)
+        self._next = 0
+
+    def deal(self, hands: int, hand_size: int) -> list[memoryview]:
+        # deals all hands at once as slices of one block of codes, without copying them
+        # the slices are views of the shoe, use bytes(hand) to keep a hand after the next shuffle()
+        needed = hands * hand_size
+        if needed > len(self):
+            raise LookupError(f'{needed} cards requested, {len(self)} left in the Shoe')
+        block = memoryview(self._codes)[self._next:self._next + needed]
+        self._next += needed
+        return [block[i:i + hand_size] for i in range(0, needed, hand_size)]
+
+
+# Monte-Carlo simulations over a Shoe ----------------
+# every trial shuffles the shoe, deals the hands and scores them with score(hands) -> value
+# trials are split in shards of a fixed size, every shard gets its own random stream,
+# seeded from (seed, shard number), so results don't depend on the number of worker processes
+# reducer(accumulator, value) folds the scores of a shard inside the worker,
+# combine(accumulator, accumulator) merges the shard results in shard order - by default it is the reducer
+# score, reducer and combine are sent to worker processes, so they must be module level functions
+
+def _run_shard(score, reducer, initial, trials, hands, hand_size, decks, seed):
+    shoe = Shoe(decks, random.Random(seed))
+    accumulator = initial
+    for _ in range(trials):
+        shoe.shuffle()
+        dealt = [Shoe.decode(hand) for hand in shoe.deal(hands, hand_size)]
+        accumulator = reducer(accumulator, score(dealt))
+    return accumulator
+
+
+def simulate(score, trials: int, *, hands: int = 1, hand_size: int = 5, decks: int = 1,
+             reducer=add, combine=None, initial=0, seed: int = 0,
+             shard_size: int = 10_000, workers: int | None = None):
+    combine = combine or reducer
+    starts = range(0, trials, shard_size)
+    shard_trials = [min(shard_size, trials - start) for start in starts]
+    shard_seeds = [f'{seed}/{shard}' for shard in range(len(starts))]
+    with ProcessPoolExecutor(workers) as executor:
+        partials = executor.map(
+            _run_shard, repeat(score), repeat(reducer), repeat(initial), shard_trials,
+            repeat(hands), repeat(hand_size), repeat(decks), shard_seeds,
+        )
+        result = initial
+        for partial in partials:
+            result = combine(result, partial)
+    return result
+
+
+def has_pair(hands) -> int:
+    # score of the demo below: 1 when the first hand has two cards of the same rank
+    ranks = [card.rank for card in hands[0]]
+    return int(len(set(ranks)) < len(ranks))
+
 
 # vector example ----------------
 class Vector:
+    __slots__ = ("x", "y")  # no __dict__ per instance, which matters when there are millions of vectors
+
     def __init__(self, x: int | float = 0, y: int | float = 0):
         self.x = x
         self.y = y
@@ -69,6 +176,73 @@ class Vector:
     def __mul__(self, scalar: int | float):
         return Vector(self.x * scalar, self.y * scalar)
 
+    # augmented assignment operators update the vector in place, v1 += v2 doesn't create a new Vector
+    # without them Python falls back to v1 = v1 + v2
+    def __iadd__(self, other: 'Vector'):
+        self.x += other.x
+        self.y += other.y
+        return self
+
+    def __imul__(self, scalar: int | float):
+        self.x *= scalar
+        self.y *= scalar
+        return self
+
+
+class VectorBatch:
+    # many vectors stored as two columns of floats, instead of one object per vector
+    # arithmetic runs over the whole columns in one call and updates them in place
+    __slots__ = ("xs", "ys")
+
+    def __init__(self, vectors=()):
+        self.xs = array('d')
+        self.ys = array('d')
+        for v in vectors:
+            self.xs.append(v.x)
+            self.ys.append(v.y)
+
+    def __len__(self):
+        return len(self.xs)
+
+    def __getitem__(self, position):
+        return Vector(self.xs[position], self.ys[position])
+
+    def __repr__(self):
+        return f"VectorBatch({list(map(Vector, self.xs, self.ys))})"
+
+    def __iadd__(self, other: 'VectorBatch | Vector'):
+        # element-wise with another batch of the same length, or the same Vector added to every vector
+        if isinstance(other, Vector):
+            other_xs, other_ys = repeat(other.x), repeat(other.y)
+        elif len(other) != len(self):
+            raise ValueError("batches must have the same length")
+        else:
+            other_xs, other_ys = other.xs, other.ys
+        self.xs[:] = array('d', map(add, self.xs, other_xs))
+        self.ys[:] = array('d', map(add, self.ys, other_ys))
+        return self
+
+    def __imul__(self, scalar: int | float):
+        self.xs[:] = array('d', map(mul, self.xs, repeat(scalar)))
+        self.ys[:] = array('d', map(mul, self.ys, repeat(scalar)))
+        return self
+
+    def __add__(self, other: 'VectorBatch | Vector'):
+        result = VectorBatch()
+        result.xs, result.ys = array('d', self.xs), array('d', self.ys)
+        result += other
+        return result
+
+    def __mul__(self, scalar: int | float):
+        result = VectorBatch()
+        result.xs, result.ys = array('d', self.xs), array('d', self.ys)
+        result *= scalar
+        return result
+
+    def magnitudes(self):
+        # abs() of every vector
+        return array('d', map(math.hypot, self.xs, self.ys))
+
 
 if __name__ == "__main__":
     # card deck example ----------------
@@ -81,6 +255,14 @@ if __name__ == "__main__":
 
     for c in sorted(d1, key=spades_high):
         print(c)
+    assert sorted(d1, key=spades_high_key) == sorted(d1, key=spades_high)
+
+    shoe = Shoe(decks=6, seed=42)
+    shoe.shuffle()
+    hands = shoe.deal(4, 5)
+    print(len(shoe), [bytes(hand).hex() for hand in hands])
+    for hand in hands:
+        print(Shoe.decode(hand))
 
     # vector example ----------------
     v1 = Vector(3, 7)
@@ -90,3 +272,20 @@ if __name__ == "__main__":
     print(v1 * 1.5)
     print(bool(v1))
     print(v1)
+    v1 += v2  # in place, v1 is still the same object
+    v1 *= 2
+    print(v1)
+
+    batch = VectorBatch([Vector(3, 4), Vector(1, 1), Vector(0, 2)])
+    batch += Vector(1, 0)
+    batch *= 2
+    print(batch)
+    print(batch.magnitudes())
+
+    # Monte-Carlo simulation example ----------------
+    import time
+
+    for workers in (1, 2, 4):
+        t0 = time.perf_counter()
+        pairs = simulate(has_pair, 100_000, seed=7, workers=workers)
+        print(f'{workers} workers: {pairs / 100_000:.4f} in {time.perf_counter() - t0:.2f}s')